@@ -0,0 +1,269 @@
+"""
+Резервное копирование базы данных без остановки бота.
+
+Снимок создается через API резервного копирования SQLite: страницы
+копируются небольшими порциями с паузами между ними, поэтому запись
+в базу не ждет окончания копирования. Снимки хранятся в backup_dir,
+самые старые удаляются, когда их больше backup_keep.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from config import Settings
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_PREFIX = 'shop-'
+SNAPSHOT_SUFFIX = '.db'
+PRE_RESTORE_LABEL = '-pre-restore'
+
+# Если база меняется другим соединением, копирование начинается заново.
+# После стольких перезапусков снимок снимается одним шагом: в режиме WAL
+# чтение всей базы не блокирует запись
+MAX_RESTARTS = 3
+
+class BackupError(Exception):
+    """
+    Ошибка создания или восстановления резервной копии
+    """
+
+class _Restarted(Exception):
+    pass
+
+class _Aborted(Exception):
+    pass
+
+class BackupResult:
+    """
+    Итог создания снимка
+    """
+    __slots__ = ('path', 'size', 'pages', 'steps', 'restarts', 'seconds')
+
+    def __init__(self, path: str, size: int, pages: int, steps: int, restarts: int, seconds: float):
+        self.path = path
+        self.size = size
+        self.pages = pages
+        self.steps = steps
+        self.restarts = restarts
+        self.seconds = seconds
+
+    @property
+    def throughput(self) -> float:
+        """
+        Скорость копирования, МБ/с
+        """
+        return self.size / 1024 / 1024 / self.seconds if self.seconds > 0 else 0.0
+
+    def __str__(self) -> str:
+        return (f"{os.path.basename(self.path)}: {self.size / 1024 / 1024:.1f} МБ за {self.seconds:.2f} с "
+                f"({self.throughput:.1f} МБ/с, шагов {self.steps}, перезапусков {self.restarts})")
+
+def _copy_pages(source: sqlite3.Connection, target: sqlite3.Connection, step_pages: int,
+                step_sleep: float, abort: Optional[threading.Event]) -> List[int]:
+    """
+    Копирует базу порциями по step_pages страниц с паузой step_sleep
+    между порциями. Возвращает [страниц, шагов, перезапусков]
+    """
+    stats = [0, 0, 0]
+    last_remaining: List[Optional[int]] = [None]
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        stats[0] = total
+        stats[1] += 1
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            stats[2] += 1
+            if stats[2] > MAX_RESTARTS:
+                raise _Restarted()
+        last_remaining[0] = remaining
+        if abort is not None and abort.is_set():
+            raise _Aborted()
+        if remaining and step_sleep:
+            time.sleep(step_sleep)
+
+    try:
+        source.backup(target, pages=step_pages, progress=progress)
+    except _Restarted:
+        logger.warning("База часто меняется во время копирования, снимок снимается одним шагом")
+        source.backup(target)
+        stats[1] += 1
+    return stats
+
+def _quick_check(conn: sqlite3.Connection) -> None:
+    result = conn.execute('PRAGMA quick_check').fetchone()[0]
+    if result != 'ok':
+        raise BackupError(f"Проверка целостности не пройдена: {result}")
+
+def list_snapshots(backup_dir: str) -> List[str]:
+    """
+    Снимки в каталоге, от новых к старым
+    """
+    try:
+        names = os.listdir(backup_dir)
+    except FileNotFoundError:
+        return []
+    snapshots = [
+        os.path.join(backup_dir, name) for name in names
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+    ]
+    # Имя содержит время создания, поэтому сортировка по имени - по времени
+    return sorted(snapshots, reverse=True)
+
+def latest_snapshot(backup_dir: str) -> Optional[str]:
+    """
+    Последний плановый снимок (снимки перед восстановлением не учитываются)
+    """
+    for path in list_snapshots(backup_dir):
+        if not path.endswith(PRE_RESTORE_LABEL + SNAPSHOT_SUFFIX):
+            return path
+    return None
+
+def rotate_snapshots(backup_dir: str, keep: int) -> List[str]:
+    """
+    Удаляет самые старые снимки сверх keep, возвращает удаленные
+    """
+    removed = list_snapshots(backup_dir)[keep:]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+def create_snapshot(db_path: str, backup_dir: str, keep: Optional[int] = None,
+                    step_pages: int = 256, step_sleep: float = 0.01,
+                    abort: Optional[threading.Event] = None, label: str = '') -> BackupResult:
+    """
+    Создает снимок базы в backup_dir. Снимок сначала пишется во временный
+    файл и проверяется, поэтому в каталоге не бывает недописанных снимков.
+    Если задан keep, старые снимки сверх этого числа удаляются
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"{SNAPSHOT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}{label}{SNAPSHOT_SUFFIX}"
+    path = os.path.join(backup_dir, name)
+    partial = path + '.part'
+
+    started = time.perf_counter()
+    source = sqlite3.connect(db_path, timeout=30.0)
+    target = sqlite3.connect(partial)
+    try:
+        pages, steps, restarts = _copy_pages(source, target, step_pages, step_sleep, abort)
+        # Снимок - один самостоятельный файл, без журнала WAL
+        target.execute('PRAGMA journal_mode=DELETE')
+        _quick_check(target)
+    except BaseException:
+        target.close()
+        os.remove(partial)
+        raise
+    finally:
+        source.close()
+    target.close()
+    os.replace(partial, path)
+    seconds = time.perf_counter() - started
+
+    if keep is not None:
+        for removed in rotate_snapshots(backup_dir, keep):
+            logger.info(f"Удален старый снимок {removed}")
+
+    return BackupResult(path, os.path.getsize(path), pages, steps, restarts, seconds)
+
+def restore_snapshot(snapshot_path: str, db_path: str, backup_dir: str) -> Optional[BackupResult]:
+    """
+    Восстанавливает базу из снимка (бот должен быть остановлен).
+    Текущая база предварительно сохраняется снимком с пометкой pre-restore,
+    он возвращается, чтобы восстановление можно было отменить
+    """
+    if not os.path.exists(snapshot_path):
+        raise BackupError(f"Снимок {snapshot_path} не найден")
+
+    source = sqlite3.connect(f'file:{snapshot_path}?mode=ro', uri=True)
+    try:
+        _quick_check(source)
+
+        previous = None
+        if os.path.exists(db_path):
+            previous = create_snapshot(db_path, backup_dir, step_pages=-1, step_sleep=0, label=PRE_RESTORE_LABEL)
+
+        target = sqlite3.connect(db_path, timeout=30.0)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+    finally:
+        source.close()
+    return previous
+
+class BackupService:
+    """
+    Создание снимков из работающего бота (по расписанию планировщика).
+    Копирование идет в отдельном потоке, цикл событий продолжает
+    обрабатывать обновления
+    """
+    def __init__(self, db_path: str = 'shop.db', backup_dir: str = 'backups',
+                 keep: int = 24, step_pages: int = 256, step_sleep: float = 0.01):
+        self.db_path = db_path
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self.step_pages = step_pages
+        self.step_sleep = step_sleep
+        self.completed = 0
+        self.failed = 0
+        self.last_result: Optional[BackupResult] = None
+        self._abort = threading.Event()
+        self._copying: Optional[asyncio.Future] = None
+        # Создается в цикле событий при первом запуске: объект создается при импорте
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def run_once(self) -> Optional[BackupResult]:
+        """
+        Создает снимок, не блокируя цикл событий. Возвращает None при ошибке
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._copying = asyncio.ensure_future(asyncio.to_thread(
+                create_snapshot, self.db_path, self.backup_dir, self.keep,
+                self.step_pages, self.step_sleep, self._abort
+            ))
+            try:
+                # Отмена задачи не должна оставлять поток копирования без присмотра
+                result = await asyncio.shield(self._copying)
+            except _Aborted:
+                logger.info("Создание снимка прервано")
+                return None
+            except Exception:
+                self.failed += 1
+                logger.exception("Ошибка создания снимка базы данных")
+                return None
+            self.completed += 1
+            self.last_result = result
+            logger.info(f"Создан снимок базы данных {result}")
+            return result
+
+    async def stop(self) -> None:
+        """
+        Прерывает копирование, если оно идет, и дожидается остановки потока
+        """
+        if self._copying is None:
+            return
+        self._abort.set()
+        # Поток копирования завершится на ближайшем шаге
+        await asyncio.wait([self._copying])
+        if not self._copying.cancelled():
+            self._copying.exception()
+        self._copying = None
+        self._abort.clear()
+
+backup_service = BackupService()
+
+def configure_backup(settings: Settings) -> None:
+    """
+    Применяет настройки резервного копирования
+    """
+    backup_service.db_path = settings.db_path
+    backup_service.backup_dir = settings.backup_dir
+    backup_service.keep = settings.backup_keep
+    backup_service.step_pages = settings.backup_step_pages
+    backup_service.step_sleep = settings.backup_step_sleep
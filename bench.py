@@ -0,0 +1,692 @@
+"""
+Бенчмарки бота.
+
+Запуск:
+    python bench.py startup [--runs N] [--config profile.json]
+    python bench.py render [--iterations N]
+    python bench.py memory [--count N]
+    python bench.py backup [--orders N] [--updates N] [--step-pages N] [--step-sleep S]
+    python bench.py callbacks [--handlers N] [--iterations N]
+    python bench.py replay RECORDING SNAPSHOT [--realtime] [--speed X] [--config profile.json]
+"""
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from collections import defaultdict
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def make_fake_session():
+    """
+    Создает сессию aiogram, которая не обращается к Telegram API
+    и отвечает True на любой запрос
+    """
+    from aiogram.client.session.base import BaseSession
+
+    class FakeSession(BaseSession):
+        async def make_request(self, bot, method, timeout=None):
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30,
+                                 chunk_size=65536, raise_for_status=True):
+            yield b''
+
+        async def close(self) -> None:
+            pass
+
+    return FakeSession()
+
+def make_message_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """
+    Собирает обновление Telegram с текстовым сообщением
+    """
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': user,
+            'text': text,
+        }
+    }
+
+def make_callback_update(update_id: int, user_id: int, data: str) -> Dict[str, Any]:
+    """
+    Собирает обновление Telegram с нажатием inline-кнопки
+    """
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}', 'username': f'user{user_id}'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'from': user,
+            'data': data,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'text': '',
+            }
+        }
+    }
+
+def _percentile(values: List[float], percent: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+# Время запуска
+async def _startup_probe() -> Dict[str, float]:
+    """
+    Выполняется в отдельном процессе: инициализирует базу, создает
+    диспетчер и обрабатывает первое обновление, замеряя каждый этап
+    """
+    timings = {'probe_start': time.time()}
+
+    from config import load_settings, set_settings
+    from database import configure_database, init_db
+    settings = load_settings()
+    set_settings(settings)
+    configure_database(settings)
+    init_db(settings.admin_id)
+    timings['db_ready'] = time.time()
+
+    from aiogram import Bot
+    from handlers import create_dispatcher
+    bot = Bot(token='42:BENCHMARK', session=make_fake_session())
+    dp = create_dispatcher()
+    timings['dispatcher_ready'] = time.time()
+
+    await dp.feed_raw_update(bot, make_message_update(1, 1001, '/start'))
+    timings['first_update'] = time.time()
+    return timings
+
+def _run_startup_probe(workdir: str, config_path: Optional[str]) -> Dict[str, float]:
+    """
+    Запускает новый интерпретатор и возвращает длительности этапов в миллисекундах
+    """
+    env = dict(os.environ, SHOP_DB_PATH=os.path.join(workdir, 'shop.db'))
+    if config_path:
+        env['SHOP_CONFIG'] = os.path.abspath(config_path)
+    spawned_at = time.time()
+    output = subprocess.run(
+        [sys.executable, os.path.join(BASE_DIR, 'bench.py'), '_startup-probe'],
+        cwd=workdir, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    timings = json.loads(output.strip().splitlines()[-1])
+    return {
+        'interpreter': (timings['probe_start'] - spawned_at) * 1000,
+        'init_db': (timings['db_ready'] - timings['probe_start']) * 1000,
+        'dispatcher': (timings['dispatcher_ready'] - timings['db_ready']) * 1000,
+        'first_update': (timings['first_update'] - timings['dispatcher_ready']) * 1000,
+        'total': (timings['first_update'] - spawned_at) * 1000,
+    }
+
+def _print_table(title: str, rows: List[Dict[str, float]]) -> None:
+    print(title)
+    for key in rows[0]:
+        values = [row[key] for row in rows]
+        print(f"  {key:<14} median {statistics.median(values):8.2f} ms   max {max(values):8.2f} ms")
+
+def bench_startup(runs: int, config_path: Optional[str]) -> None:
+    """
+    Время от запуска процесса до обработки первого обновления:
+    на новой базе (выполняются миграции) и на уже созданной (DDL пропускается)
+    """
+    cold, warm = [], []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            cold.append(_run_startup_probe(workdir, config_path))
+            warm.append(_run_startup_probe(workdir, config_path))
+    _print_table(f"Запуск на новой базе (запусков: {runs}):", cold)
+    _print_table(f"Запуск на существующей базе (запусков: {runs}):", warm)
+
+# Отрисовка деталей заказа
+def _legacy_order_details(details: Dict[str, Any], order_id: int):
+    """
+    Прежняя отрисовка деталей заказа: конкатенация строк
+    и новая клавиатура на каждый вызов
+    """
+    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+    order = details['order']
+    user_info = details['user_info']
+    items = details['items']
+
+    response = f"📦 <b>Детали заказа №{order[0]}</b>\n\n"
+    response += f"👤 <b>Клиент:</b> {user_info[1]}"
+    if user_info[0]:
+        response += f" (@{user_info[0]})"
+    response += f"\n<b>ID пользователя:</b> {order[1]}\n\n"
+    response += f"<b>Дата заказа:</b> {order[2]}\n"
+    response += f"<b>Статус:</b> {order[3]}\n\n"
+    response += "<b>Товары в заказе:</b>\n"
+    total_items = 0
+    for item in items:
+        name, quantity, price = item
+        total_items += quantity
+        response += f"• {name} x {quantity} = {price * quantity:.2f} грн.\n"
+    response += f"\n<b>Всего товаров:</b> {total_items} шт."
+    response += f"\n<b>Итого:</b> {order[4]:.2f} грн."
+
+    markup = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="В обработке", callback_data=f"status:{order_id}:В обработке"),
+                InlineKeyboardButton(text="Отправлен", callback_data=f"status:{order_id}:Отправлен")
+            ],
+            [
+                InlineKeyboardButton(text="Доставлен", callback_data=f"status:{order_id}:Доставлен"),
+                InlineKeyboardButton(text="Отменен", callback_data=f"status:{order_id}:Отменен")
+            ],
+            [
+                InlineKeyboardButton(text="« Назад к списку", callback_data="filter_orders:all")
+            ]
+        ]
+    )
+    return response, markup
+
+def _current_order_details(order, order_id: int):
+    from rendering import order_status_keyboard, render_order_details
+    return render_order_details(order), order_status_keyboard(order_id, order.status)
+
+def _measure_render(render, details: Any, order_id: int, iterations: int) -> Dict[str, float]:
+    """
+    Время одного вызова и память, выделенная за один вызов
+    """
+    render(details, order_id)
+    seconds = min(timeit.repeat(lambda: render(details, order_id), number=iterations, repeat=3))
+
+    tracemalloc.start()
+    render(details, order_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'us_per_render': seconds / iterations * 1e6, 'peak_bytes': peak}
+
+def bench_render(iterations: int) -> None:
+    """
+    Сравнение прежней и текущей отрисовки деталей заказа администратора
+    """
+    details = {
+        'order': (42, 1001, '2024-01-01 12:00:00', 'В обработке', 12345.0),
+        'user_info': ('user1001', 'Иван Петров'),
+        'items': [(f'Товар {i}', i % 3 + 1, 100.0 + i) for i in range(8)],
+    }
+    from models import Order, OrderItem, OrderStatus
+    order = Order(42, 1001, '2024-01-01 12:00:00', OrderStatus.PROCESSING, 12345.0)
+    order.username, order.full_name = details['user_info']
+    order.items = tuple(OrderItem(*item) for item in details['items'])
+
+    legacy = _measure_render(_legacy_order_details, details, 42, iterations)
+    current = _measure_render(_current_order_details, order, 42, iterations)
+
+    print(f"Детали заказа ({len(details['items'])} позиций, {iterations} повторов):")
+    print(f"  {'':<10} {'мкс/вызов':>10} {'память, байт':>14}")
+    print(f"  {'прежняя':<10} {legacy['us_per_render']:>10.2f} {legacy['peak_bytes']:>14}")
+    print(f"  {'текущая':<10} {current['us_per_render']:>10.2f} {current['peak_bytes']:>14}")
+
+# Память моделей
+def _traced_size(build) -> int:
+    """
+    Объем памяти, который остается занятым объектом, созданным build()
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del obj
+    return size
+
+def bench_memory(count: int) -> None:
+    """
+    Память на товар в кэше и на состояние корзины одной сессии:
+    кортежи и словари против моделей со __slots__ и сериализованной корзины
+    """
+    import uuid
+    from models import Cart, Product
+
+    rows = [(i, f'Товар {i}', f'Описание товара {i}', 100.0 + i, i % 50) for i in range(count)]
+
+    # Создаются новые контейнеры; значения полей общие, как и у строк из курсора
+    tuples = _traced_size(lambda: [tuple([*row]) for row in rows])
+    products = _traced_size(lambda: [Product(*row) for row in rows])
+
+    cart_items = [(i * 7 % 100 + 1, i % 3 + 1) for i in range(5)]
+
+    def legacy_sessions():
+        return [
+            {'selected_product_id': 1, 'cart': {pid: qty for pid, qty in cart_items},
+             'cart_key': uuid.uuid4().hex, 'cart_total': 1234.5}
+            for _ in range(count)
+        ]
+
+    def current_sessions():
+        sessions = []
+        for _ in range(count):
+            cart = Cart(uuid.uuid4().hex)
+            for pid, qty in cart_items:
+                cart.add(pid, qty)
+            sessions.append({'selected_product_id': 1, 'cart': cart.dumps(), 'cart_total': 1234.5})
+        return sessions
+
+    legacy = _traced_size(legacy_sessions)
+    current = _traced_size(current_sessions)
+
+    print(f"Память на объект ({count} объектов), байт:")
+    print(f"  товар в кэше:      кортеж {tuples / count:8.1f}   Product {products / count:8.1f}")
+    print(f"  состояние сессии:  словарь {legacy / count:7.1f}   Cart    {current / count:8.1f}")
+
+# Резервное копирование под нагрузкой
+def _fill_orders(count: int) -> None:
+    """
+    Добавляет заказы, чтобы размер базы был ближе к рабочей
+    """
+    from database import connect
+    with connect() as conn:
+        conn.executemany(
+            'INSERT INTO orders (user_id, order_date, status, total_price, idempotency_key) VALUES (?, ?, 0, ?, ?)',
+            ((2000 + i % 500, '2024-01-01 12:00:00', 100.0 + i, f'bench-{i}') for i in range(count))
+        )
+        conn.executemany(
+            'INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, 1, ?)',
+            ((i + 1, i % 5 + 1, 100.0) for i in range(count))
+        )
+        conn.commit()
+
+def _backup_workload(admin_id: int) -> Iterator[Dict[str, Any]]:
+    """
+    Бесконечный поток обновлений: просмотр каталога покупателями
+    и изменение остатков администратором (запись в базу)
+    """
+    from callbacks import UPDATE_STOCK
+
+    update_ids = itertools.count(1)
+    for i in itertools.count():
+        yield make_message_update(next(update_ids), 1000 + i % 100, '/catalog')
+        yield make_message_update(next(update_ids), admin_id, '/stock')
+        yield make_callback_update(next(update_ids), admin_id, UPDATE_STOCK.pack(i % 5 + 1))
+        yield make_message_update(next(update_ids), admin_id, str(50 + i % 10))
+
+async def _measure_handlers(dp, bot, updates: Iterator[Dict[str, Any]], minimum: int,
+                            until: Callable[[], bool]) -> List[float]:
+    """
+    Обрабатывает обновления по одному, пока не выполнено until и не
+    обработано минимум minimum обновлений; возвращает задержки в мс
+    """
+    latencies = []
+    while len(latencies) < minimum or not until():
+        update = next(updates)
+        started = time.perf_counter()
+        await dp.feed_raw_update(bot, update)
+        latencies.append((time.perf_counter() - started) * 1000)
+        # Даем потоку копирования получить GIL, как между обновлениями в работе
+        await asyncio.sleep(0)
+    return latencies
+
+async def _backup_probe(settings, updates_count: int) -> None:
+    from aiogram import Bot
+    from backup import create_snapshot
+    from handlers import create_dispatcher
+
+    bot = Bot(token='42:BENCHMARK', session=make_fake_session())
+    dp = create_dispatcher()
+    updates = _backup_workload(settings.admin_id)
+
+    idle = await _measure_handlers(dp, bot, updates, updates_count, lambda: True)
+
+    copying = asyncio.ensure_future(asyncio.to_thread(
+        create_snapshot, settings.db_path, settings.backup_dir, None,
+        settings.backup_step_pages, settings.backup_step_sleep
+    ))
+    during = await _measure_handlers(dp, bot, updates, 1, copying.done)
+    result = await copying
+
+    print(f"Снимок {result}")
+    print(f"  {'':<16} {'обновлений':>10} {'p50, мс':>9} {'p99, мс':>9} {'макс, мс':>9}")
+    for title, latencies in (('без копирования', idle), ('при копировании', during)):
+        print(f"  {title:<16} {len(latencies):>10} {_percentile(latencies, 50):>9.2f} "
+              f"{_percentile(latencies, 99):>9.2f} {max(latencies):>9.2f}")
+
+def bench_backup(orders: int, updates_count: int, step_pages: Optional[int], step_sleep: Optional[float]) -> None:
+    """
+    Скорость создания снимка и задержка обработки обновлений
+    во время копирования по сравнению с работой без него
+    """
+    from config import load_settings, set_settings
+    from database import close_database, configure_database, connect, init_db, seed_sample_products
+
+    with tempfile.TemporaryDirectory() as workdir:
+        environ = {
+            'SHOP_DB_PATH': os.path.join(workdir, 'shop.db'),
+            'SHOP_BACKUP_DIR': os.path.join(workdir, 'backups'),
+            # Ограничение частоты запросов не должно влиять на замер
+            'SHOP_THROTTLE_LIMITS': '{}',
+            'SHOP_THROTTLE_DEFAULT_LIMIT': '[1000000, 1000000]',
+        }
+        if step_pages is not None:
+            environ['SHOP_BACKUP_STEP_PAGES'] = str(step_pages)
+        if step_sleep is not None:
+            environ['SHOP_BACKUP_STEP_SLEEP'] = str(step_sleep)
+        settings = load_settings(environ=environ)
+        set_settings(settings)
+        configure_database(settings)
+        init_db(settings.admin_id)
+        seed_sample_products()
+        _fill_orders(orders)
+        # В режиме WAL данные лежат в журнале, пока он не перенесен в файл базы
+        with connect() as conn:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+        print(f"База: {os.path.getsize(settings.db_path) / 1024 / 1024:.1f} МБ, заказов {orders}, "
+              f"страниц за шаг {settings.backup_step_pages}, пауза {settings.backup_step_sleep} с")
+        asyncio.run(_backup_probe(settings, updates_count))
+
+        # Без изменений остатков нагрузка только читает базу и замер не показателен
+        with connect() as conn:
+            stock_changes = conn.execute("SELECT COUNT(*) FROM audit_log WHERE field = 'stock'").fetchone()[0]
+        close_database()
+        if not stock_changes:
+            raise SystemExit("Остатки товаров не изменились: нагрузка не записывала в базу")
+        print(f"Изменений остатков: {stock_changes}")
+
+# Маршрутизация callback-запросов
+def _callback_dispatchers(count: int):
+    """
+    Два диспетчера с count обработчиками callback: цепочка фильтров
+    F.data.startswith и таблица по префиксу. Возвращает их и данные
+    кнопок для каждого обработчика
+    """
+    from aiogram import Dispatcher, F, Router
+    from callbacks import CallbackKind, CallbackTable, encode_int
+
+    async def legacy_handler(callback_query) -> None:
+        pass
+
+    async def table_handler(callback_query, state, value) -> None:
+        pass
+
+    legacy_router = Router()
+    table = CallbackTable()
+    legacy_data, table_data = [], []
+    for i in range(count):
+        legacy_router.callback_query.register(legacy_handler, F.data.startswith(f'action_{i}:'))
+        legacy_data.append(f'action_{i}:123456')
+        kind = CallbackKind(f'action_{i}', encode_int(i), int)
+        table.register(kind)(table_handler)
+        table_data.append(kind.pack(123456))
+
+    legacy = Dispatcher()
+    legacy.include_router(legacy_router)
+
+    table_router = Router()
+    table_router.callback_query.register(table.dispatch)
+    current = Dispatcher()
+    current.include_router(table_router)
+
+    return (legacy, legacy_data), (current, table_data)
+
+async def _measure_dispatch(dp, bot, data: str, iterations: int, repeat: int = 5) -> float:
+    """
+    Время обработки одного callback-запроса, мкс (лучшее из repeat замеров)
+    """
+    from aiogram.types import Update
+    update = Update.model_validate(make_callback_update(1, 1001, data), context={'bot': bot})
+    await dp.feed_update(bot, update)
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            await dp.feed_update(bot, update)
+        best = min(best, time.perf_counter() - started)
+    return best / iterations * 1e6
+
+async def _callbacks_probe(count: int, iterations: int) -> None:
+    from aiogram import Bot
+    bot = Bot(token='42:BENCHMARK', session=make_fake_session())
+    (legacy, legacy_data), (current, table_data) = _callback_dispatchers(count)
+
+    print(f"Обработка callback-запроса ({count} обработчиков, {iterations} повторов), мкс:")
+    print(f"  {'обработчик':<12} {'фильтры':>9} {'таблица':>9}")
+    for title, index in (('первый', 0), ('средний', count // 2), ('последний', count - 1)):
+        legacy_us = await _measure_dispatch(legacy, bot, legacy_data[index], iterations)
+        table_us = await _measure_dispatch(current, bot, table_data[index], iterations)
+        print(f"  {title:<12} {legacy_us:>9.1f} {table_us:>9.1f}")
+
+def bench_callbacks(count: int, iterations: int) -> None:
+    """
+    Время маршрутизации callback-запросов и размер данных кнопок
+    """
+    from callbacks import FILTER_ORDERS, ORDER_STATUS, QUANTITY
+    from models import OrderStatus
+
+    # Прежний формат данных кнопок с названием статуса
+    samples = (
+        ('статус заказа', 'status:123456:В обработке', ORDER_STATUS.pack(123456, OrderStatus.PROCESSING)),
+        ('фильтр заказов', 'filter_orders:Отправлен', FILTER_ORDERS.pack(OrderStatus.SHIPPED)),
+        ('количество', 'quantity:10', QUANTITY.pack(10)),
+    )
+    print("Данные кнопок, байт (ограничение Telegram - 64):")
+    for title, legacy, compact in samples:
+        print(f"  {title:<16} {len(legacy.encode()):>3} {legacy!r:<30} -> {len(compact.encode()):>3} {compact!r}")
+    print()
+
+    asyncio.run(_callbacks_probe(count, iterations))
+
+# Воспроизведение записанных обновлений
+UNHANDLED_LABEL = '<не обработано>'
+
+class _ReplayProfiler:
+    """
+    Время обработки и число запросов к базе по обработчикам. Внешний
+    middleware замеряет обработку обновления целиком, внутренний узнает,
+    какой обработчик был выбран (для callback - обработчик из таблицы)
+    """
+    def __init__(self, callback_table):
+        self.callback_table = callback_table
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.queries: Dict[str, int] = defaultdict(int)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.background_queries = 0
+        # [обработчик, запросов] для обновления, обрабатываемого в текущей задаче
+        self._current: contextvars.ContextVar = contextvars.ContextVar('replay_update', default=None)
+
+    def on_statement(self, statement: str) -> None:
+        # Строки '-- TRIGGER ...' - срабатывание триггера внутри запроса, а не новый запрос
+        if statement.startswith('--'):
+            return
+        current = self._current.get()
+        if current is None:
+            # Пакетная запись в фоновых задачах
+            self.background_queries += 1
+        else:
+            current[1] += 1
+
+    def _label(self, event: Any, data: Dict[str, Any]) -> Optional[str]:
+        callback = data['handler'].callback
+        if getattr(callback, '__self__', None) is self.callback_table:
+            route = self.callback_table.resolve(event.data or '', data.get('raw_state'))
+            return route[1].__name__ if route is not None else None
+        return getattr(callback, '__name__', repr(callback))
+
+    async def outer(self, handler, event, data) -> Any:
+        current = [UNHANDLED_LABEL, 0]
+        token = self._current.set(current)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors[current[0]] += 1
+            raise
+        finally:
+            self._current.reset(token)
+            self.latencies[current[0]].append((time.perf_counter() - started) * 1000)
+            self.queries[current[0]] += current[1]
+
+    async def inner(self, handler, event, data) -> Any:
+        current = self._current.get()
+        label = self._label(event, data) if current is not None else None
+        if label is not None:
+            current[0] = label
+        return await handler(event, data)
+
+async def _replay_probe(recording: str, realtime: bool, speed: float) -> None:
+    from aiogram import Bot
+    from config import get_settings
+    from database import configure_database, set_statement_hook
+    from handlers import callback_table, create_dispatcher
+    from recorder import read_recording
+    from writers import start_writers, stop_writers
+
+    bot = Bot(token='42:BENCHMARK', session=make_fake_session())
+    dp = create_dispatcher()
+    profiler = _ReplayProfiler(callback_table)
+    set_statement_hook(profiler.on_statement)
+    # Пул создается заново, чтобы запросы считались на всех соединениях
+    configure_database(get_settings())
+    dp.update.outer_middleware(profiler.outer)
+    dp.message.middleware(profiler.inner)
+    dp.callback_query.middleware(profiler.inner)
+    start_writers()
+
+    async def feed(update: Dict[str, Any]) -> None:
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception:
+            # Ошибка уже учтена профилировщиком, воспроизведение продолжается
+            pass
+
+    count = 0
+    tasks = []
+    started = time.perf_counter()
+    for at, update in read_recording(recording):
+        count += 1
+        if not realtime:
+            await feed(update)
+            continue
+        # Как при опросе: обновления обрабатываются параллельно в исходном темпе
+        delay = started + at / speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(feed(update)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await stop_writers()
+
+    mode = f"в исходном темпе (x{speed:g})" if realtime else "как можно быстрее"
+    print(f"Воспроизведено обновлений: {count} за {elapsed:.2f} с ({count / elapsed if elapsed else 0:.0f} в секунду), {mode}")
+    print(f"  {'обработчик':<32} {'обновлений':>10} {'p50, мс':>8} {'p95, мс':>8} {'макс, мс':>9} "
+          f"{'запросов':>9} {'ошибок':>7}")
+    by_total = sorted(profiler.latencies.items(), key=lambda item: sum(item[1]), reverse=True)
+    for label, latencies in by_total:
+        print(f"  {label:<32} {len(latencies):>10} {_percentile(latencies, 50):>8.2f} "
+              f"{_percentile(latencies, 95):>8.2f} {max(latencies):>9.2f} "
+              f"{profiler.queries[label] / len(latencies):>9.1f} {profiler.errors[label]:>7}")
+    print(f"Запросов к базе: {sum(profiler.queries.values())} при обработке обновлений, "
+          f"{profiler.background_queries} при фоновой записи")
+
+def bench_replay(recording: str, snapshot: str, realtime: bool, speed: float, config_path: Optional[str]) -> None:
+    """
+    Воспроизводит записанные обновления на копии снимка базы с ботом,
+    который не обращается к Telegram. Выводит задержку и число запросов
+    к базе по обработчикам, чтобы сравнивать версии бота на реальной нагрузке
+    """
+    from config import load_settings, set_settings
+    from database import close_database, configure_database, init_db
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = os.path.join(workdir, 'shop.db')
+        # Воспроизведение меняет базу, поэтому работаем с копией снимка
+        source = sqlite3.connect(f'file:{snapshot}?mode=ro', uri=True)
+        target = sqlite3.connect(db_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+        environ = {'SHOP_DB_PATH': db_path}
+        if not realtime:
+            # В ускоренном режиме ограничение частоты отбросило бы большую часть обновлений
+            environ['SHOP_THROTTLE_LIMITS'] = '{}'
+            environ['SHOP_THROTTLE_DEFAULT_LIMIT'] = '[1000000, 1000000]'
+        settings = load_settings(config_path, environ=environ)
+        set_settings(settings)
+        configure_database(settings)
+        # Снимок мог быть сделан до последних миграций
+        init_db(settings.admin_id)
+        asyncio.run(_replay_probe(recording, realtime, speed))
+        close_database()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Бенчмарки бота")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    startup = subparsers.add_parser('startup', help="время до обработки первого обновления")
+    startup.add_argument('--runs', type=int, default=5)
+    startup.add_argument('--config', help="файл настроек с профилем для замера")
+
+    render = subparsers.add_parser('render', help="время и память отрисовки деталей заказа")
+    render.add_argument('--iterations', type=int, default=10000)
+
+    memory = subparsers.add_parser('memory', help="память на товар в кэше и на сессию покупателя")
+    memory.add_argument('--count', type=int, default=10000)
+
+    backup = subparsers.add_parser('backup', help="скорость снимка базы и задержка обработчиков во время него")
+    backup.add_argument('--orders', type=int, default=200000)
+    backup.add_argument('--updates', type=int, default=2000)
+    backup.add_argument('--step-pages', type=int, help="страниц за шаг (по умолчанию из настроек)")
+    backup.add_argument('--step-sleep', type=float, help="пауза между шагами, с (по умолчанию из настроек)")
+
+    callbacks = subparsers.add_parser('callbacks', help="маршрутизация callback-запросов и размер данных кнопок")
+    callbacks.add_argument('--handlers', type=int, default=48)
+    callbacks.add_argument('--iterations', type=int, default=2000)
+
+    replay = subparsers.add_parser('replay', help="воспроизведение записанных обновлений на снимке базы")
+    replay.add_argument('recording', help="файл записи (updates-*.ndjson.gz)")
+    replay.add_argument('snapshot', help="снимок базы данных (не изменяется)")
+    replay.add_argument('--realtime', action='store_true', help="в исходном темпе (по умолчанию - как можно быстрее)")
+    replay.add_argument('--speed', type=float, default=1.0, help="ускорение исходного темпа для --realtime")
+    replay.add_argument('--config', help="файл настроек (например, с admin_id)")
+
+    subparsers.add_parser('_startup-probe')
+
+    args = parser.parse_args()
+    sys.path.insert(0, BASE_DIR)
+
+    if args.benchmark == 'startup':
+        bench_startup(args.runs, args.config)
+    elif args.benchmark == 'render':
+        bench_render(args.iterations)
+    elif args.benchmark == 'memory':
+        bench_memory(args.count)
+    elif args.benchmark == 'callbacks':
+        bench_callbacks(args.handlers, args.iterations)
+    elif args.benchmark == 'backup':
+        logging.disable(logging.CRITICAL)
+        bench_backup(args.orders, args.updates, args.step_pages, args.step_sleep)
+    elif args.benchmark == 'replay':
+        logging.disable(logging.INFO)
+        bench_replay(args.recording, args.snapshot, args.realtime, args.speed, args.config)
+    elif args.benchmark == '_startup-probe':
+        logging.disable(logging.CRITICAL)
+        print(json.dumps(asyncio.run(_startup_probe())))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Данные inline-кнопок и маршрутизация callback-запросов.
+
+Данные кнопки - короткий префикс вида и поля через ':', числа записываются
+в base36. Обработчик выбирается по префиксу и состоянию FSM поиском
+в словаре, а не перебором фильтров F.data.startswith(...) по роутерам.
+"""
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery
+
+from models import OrderStatus
+
+logger = logging.getLogger(__name__)
+
+SEPARATOR = ':'
+
+# Ограничение Telegram на размер callback_data, байт
+MAX_CALLBACK_DATA = 64
+
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+def encode_int(value: int) -> str:
+    """
+    Записывает целое число в base36
+    """
+    if value < 0:
+        return '-' + encode_int(-value)
+    digits = []
+    while True:
+        value, digit = divmod(value, 36)
+        digits.append(_DIGITS[digit])
+        if not value:
+            return ''.join(reversed(digits))
+
+class Nullable:
+    """
+    Целочисленное поле, которое может быть None (записывается пустой строкой)
+    """
+    __slots__ = ('type',)
+
+    def __init__(self, type: type):
+        self.type = type
+
+class CallbackKind:
+    """
+    Вид данных кнопки: префикс и типы полей. Поле - str, целочисленный
+    тип (int, IntEnum) или Nullable(целочисленный тип). Пустое значение
+    допускается только в поле Nullable
+    """
+    __slots__ = ('name', 'prefix', 'fields')
+
+    def __init__(self, name: str, prefix: str, *fields: type):
+        if SEPARATOR in prefix:
+            raise ValueError(f"Префикс '{prefix}' не может содержать '{SEPARATOR}'")
+        self.name = name
+        self.prefix = prefix
+        self.fields = fields
+
+    def pack(self, *values: Any) -> str:
+        """
+        Собирает данные кнопки из значений полей
+        """
+        if len(values) != len(self.fields):
+            raise ValueError(f"{self.name}: ожидается полей {len(self.fields)}, передано {len(values)}")
+        parts = [self.prefix]
+        for field, value in zip(self.fields, values):
+            if field is str:
+                if SEPARATOR in value:
+                    raise ValueError(f"{self.name}: значение '{value}' содержит '{SEPARATOR}'")
+                parts.append(value)
+            elif value is None:
+                if not isinstance(field, Nullable):
+                    raise ValueError(f"{self.name}: поле не может быть пустым")
+                parts.append('')
+            else:
+                parts.append(encode_int(int(value)))
+        data = SEPARATOR.join(parts)
+        if len(data.encode()) > MAX_CALLBACK_DATA:
+            raise ValueError(f"{self.name}: данные кнопки длиннее {MAX_CALLBACK_DATA} байт")
+        return data
+
+    def unpack(self, payload: str) -> Tuple[Any, ...]:
+        """
+        Разбирает поля (данные кнопки без префикса), вызывает ValueError,
+        если они не соответствуют виду
+        """
+        parts = payload.split(SEPARATOR) if self.fields else []
+        if len(parts) != len(self.fields):
+            raise ValueError(f"{self.name}: некорректные данные кнопки '{payload}'")
+        return tuple(self._decode(field, part) for field, part in zip(self.fields, parts))
+
+    def _decode(self, field: Any, part: str) -> Any:
+        if field is str:
+            return part
+        if isinstance(field, Nullable):
+            if part == '':
+                return None
+            field = field.type
+        # Пустая строка или неизвестный код статуса - тоже ValueError
+        return field(int(part, 36))
+
+# Виды кнопок бота. Имя вида - ключ лимитов запросов в настройках, поэтому
+# оно не должно совпадать с именем команды (иначе у них общий лимит)
+ADD_TO_CART = CallbackKind('add_to_cart', 'p', int)
+QUANTITY = CallbackKind('quantity', 'q', int)
+CART = CallbackKind('cart', 'c', str)
+UPDATE_STOCK = CallbackKind('update_stock', 'u', int)
+WAREHOUSE_STOCK = CallbackKind('warehouse_stock', 'w', int, int)
+FILTER_ORDERS = CallbackKind('filter_orders', 'f', Nullable(OrderStatus))
+ORDER_STATUS = CallbackKind('order_status', 's', int, OrderStatus)
+
+KINDS: Dict[str, CallbackKind] = {
+    kind.prefix: kind
+    for kind in (ADD_TO_CART, QUANTITY, CART, UPDATE_STOCK, WAREHOUSE_STOCK, FILTER_ORDERS, ORDER_STATUS)
+}
+
+def callback_name(data: str) -> str:
+    """
+    Имя вида кнопки по ее данным (префикс, если вид неизвестен)
+    """
+    prefix = data.partition(SEPARATOR)[0]
+    kind = KINDS.get(prefix)
+    return kind.name if kind is not None else prefix
+
+CallbackHandler = Callable[..., Awaitable[Any]]
+
+class CallbackTable:
+    """
+    Таблица обработчиков callback-запросов: префикс вида -> состояние FSM ->
+    обработчик. Обработчик получает callback, контекст FSM и разобранные поля
+    """
+    def __init__(self):
+        self._routes: Dict[str, Dict[Optional[str], Tuple[CallbackKind, CallbackHandler]]] = {}
+
+    def register(self, kind: CallbackKind, *states: State) -> Callable[[CallbackHandler], CallbackHandler]:
+        """
+        Декоратор: регистрирует обработчик вида кнопки в указанных
+        состояниях (без состояний - в любом)
+        """
+        def decorator(handler: CallbackHandler) -> CallbackHandler:
+            routes = self._routes.setdefault(kind.prefix, {})
+            for state in states or (None,):
+                key = state.state if state is not None else None
+                if key in routes:
+                    raise ValueError(f"Обработчик '{kind.name}' для состояния {key} уже зарегистрирован")
+                routes[key] = (kind, handler)
+            return handler
+        return decorator
+
+    def resolve(self, data: str, raw_state: Optional[str]) -> Optional[Tuple[CallbackKind, CallbackHandler]]:
+        """
+        Вид кнопки и обработчик для данных кнопки в состоянии raw_state
+        """
+        routes = self._routes.get(data.partition(SEPARATOR)[0])
+        if routes is None:
+            return None
+        return routes.get(raw_state) or routes.get(None)
+
+    async def dispatch(self, callback_query: CallbackQuery, state: FSMContext, raw_state: Optional[str]) -> Any:
+        """
+        Обработчик aiogram для всех callback-запросов. Если подходящего
+        обработчика нет, запрос передается дальше (SkipHandler)
+        """
+        route = self.resolve(callback_query.data or '', raw_state)
+        if route is None:
+            raise SkipHandler()
+
+        kind, handler = route
+        payload = (callback_query.data or '').partition(SEPARATOR)[2]
+        try:
+            values = kind.unpack(payload)
+        except ValueError:
+            logger.warning(f"Некорректные данные кнопки '{callback_query.data}' от пользователя {callback_query.from_user.id}")
+            await callback_query.answer()
+            return None
+        return await handler(callback_query, state, *values)
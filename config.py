@@ -0,0 +1,221 @@
+import json
+import os
+from dataclasses import dataclass, field, fields, replace
+from typing import Dict, Any, Optional, Tuple
+
+from scheduler import parse_cron
+
+# Лимиты для команд и префиксов callback: (запросов в секунду, размер пачки)
+DEFAULT_THROTTLE_LIMITS: Dict[str, Tuple[float, int]] = {
+    'catalog': (0.5, 3),
+    'order': (0.5, 3),
+    'stock': (0.5, 3),
+    'orders': (0.5, 3),
+    'add_to_cart': (2.0, 5),
+    'quantity': (2.0, 5),
+    'cart': (1.0, 3),
+}
+
+# Стратегии выбора склада при оформлении заказа: ближайший склад
+# (по приоритету склада) или склад с наибольшим остатком
+STOCK_ALLOCATION_STRATEGIES = ('nearest', 'most_stocked')
+
+# Префикс переменных окружения, например SHOP_DB_PATH=/var/lib/shop/shop.db
+ENV_PREFIX = 'SHOP_'
+
+class ConfigError(ValueError):
+    """
+    Ошибка в настройках бота
+    """
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Настройки бота. Значения по умолчанию переопределяются файлом
+    настроек (JSON), а затем переменными окружения SHOP_<ИМЯ_ПОЛЯ>
+    """
+    # Telegram
+    api_token: str = 'YOUR_BOT_TOKEN'
+    admin_id: int = 123456789
+
+    # База данных
+    db_path: str = 'shop.db'
+    db_pool_size: int = 4
+
+    # Кэширование
+    product_cache_ttl: float = 30.0
+
+    # Выбор склада для списания товара при оформлении заказа
+    stock_allocation: str = 'nearest'
+
+    # Размеры страниц и ограничения интерфейса
+    orders_page_size: int = 15
+    max_quantity_per_item: int = 10
+
+    # Защита от повторов и ограничение частоты запросов
+    dedup_cache_size: int = 10000
+    throttle_limits: Dict[str, Tuple[float, int]] = field(
+        default_factory=lambda: dict(DEFAULT_THROTTLE_LIMITS)
+    )
+    throttle_default_limit: Tuple[float, int] = (3.0, 10)
+    throttle_ttl: float = 600.0
+
+    # Отложенная запись профилей пользователей
+    user_flush_interval: float = 2.0
+    user_flush_batch_size: int = 100
+    user_cache_size: int = 10000
+
+    # Журнал изменений остатков и статусов
+    audit_flush_interval: float = 1.0
+    audit_flush_batch_size: int = 200
+    audit_history_limit: int = 20
+
+    # Фоновые задачи обслуживания. Интервалы в секундах (0 - отключено),
+    # расписания в формате cron ('' - отключено), jitter - случайная
+    # задержка запуска в секундах
+    job_jitter: float = 5.0
+    cart_ttl: float = 86400.0
+    cart_cleanup_interval: float = 600.0
+    cache_refresh_interval: float = 25.0
+    optimize_cron: str = '0 * * * *'
+    compact_cron: str = '30 4 * * *'
+    compact_min_free_ratio: float = 0.2
+
+    # Резервное копирование: интервал в секундах (0 - отключено), число
+    # хранимых снимков, страниц за шаг и пауза между шагами в секундах
+    backup_dir: str = 'backups'
+    backup_interval: float = 3600.0
+    backup_keep: int = 24
+    backup_step_pages: int = 256
+    backup_step_sleep: float = 0.01
+
+    # Запись входящих обновлений (без личных данных) для воспроизведения
+    # командой python bench.py replay
+    record_updates: bool = False
+    record_dir: str = 'recordings'
+
+    # Максимальное число одновременно обрабатываемых обновлений
+    max_concurrent_updates: int = 100
+
+    # Сколько секунд при остановке ждать завершения начатых обработчиков
+    # и фоновых задач
+    shutdown_timeout: float = 25.0
+
+    def validate(self) -> None:
+        """
+        Проверяет значения настроек, вызывает ConfigError при ошибке
+        """
+        for name in ('db_path', 'backup_dir', 'record_dir'):
+            if not getattr(self, name):
+                raise ConfigError(f"{name} не может быть пустым")
+
+        for name in ('db_pool_size', 'orders_page_size', 'max_quantity_per_item',
+                     'dedup_cache_size', 'max_concurrent_updates',
+                     'user_flush_batch_size', 'user_cache_size',
+                     'audit_flush_batch_size', 'audit_history_limit',
+                     'backup_keep', 'backup_step_pages'):
+            if getattr(self, name) < 1:
+                raise ConfigError(f"{name} должен быть положительным числом")
+
+        for name in ('product_cache_ttl', 'throttle_ttl', 'backup_interval', 'backup_step_sleep',
+                     'job_jitter', 'cart_cleanup_interval', 'cache_refresh_interval',
+                     'shutdown_timeout'):
+            if getattr(self, name) < 0:
+                raise ConfigError(f"{name} не может быть отрицательным")
+
+        for name in ('user_flush_interval', 'audit_flush_interval', 'cart_ttl'):
+            if getattr(self, name) <= 0:
+                raise ConfigError(f"{name} должен быть положительным числом")
+
+        for name in ('optimize_cron', 'compact_cron'):
+            if getattr(self, name):
+                try:
+                    parse_cron(getattr(self, name))
+                except ValueError as e:
+                    raise ConfigError(f"{name}: {e}") from e
+
+        if not 0 <= self.compact_min_free_ratio <= 1:
+            raise ConfigError("compact_min_free_ratio должен быть от 0 до 1")
+
+        if self.stock_allocation not in STOCK_ALLOCATION_STRATEGIES:
+            raise ConfigError(
+                f"stock_allocation должен быть одним из: {', '.join(STOCK_ALLOCATION_STRATEGIES)}"
+            )
+
+        limits = dict(self.throttle_limits, **{'<default>': self.throttle_default_limit})
+        for key, (rate, burst) in limits.items():
+            if rate <= 0 or burst < 1:
+                raise ConfigError(f"Некорректный лимит запросов для '{key}': {rate}/с, пачка {burst}")
+
+def _convert(name: str, value: Any, default: Any) -> Any:
+    """
+    Приводит значение из файла или окружения к типу поля настроек
+    """
+    try:
+        if isinstance(default, dict):
+            if isinstance(value, str):
+                value = json.loads(value)
+            return {str(k): (float(v[0]), int(v[1])) for k, v in value.items()}
+        if isinstance(default, bool):
+            if isinstance(value, str):
+                if value.lower() not in ('1', 'true', 'yes', '0', 'false', 'no'):
+                    raise ValueError(value)
+                return value.lower() in ('1', 'true', 'yes')
+            return bool(value)
+        if isinstance(default, tuple):
+            if isinstance(value, str):
+                value = json.loads(value)
+            return (float(value[0]), int(value[1]))
+        return type(default)(value)
+    except (TypeError, ValueError, IndexError, AttributeError) as e:
+        raise ConfigError(f"Некорректное значение параметра {name}: {value!r}") from e
+
+def load_settings(path: Optional[str] = None, environ: Optional[Dict[str, str]] = None) -> Settings:
+    """
+    Загружает и проверяет настройки: значения по умолчанию, затем файл
+    настроек (путь из аргумента или SHOP_CONFIG), затем переменные окружения
+    """
+    environ = os.environ if environ is None else environ
+    path = path or environ.get(f'{ENV_PREFIX}CONFIG')
+    defaults = Settings()
+    known = {f.name for f in fields(Settings)}
+    values: Dict[str, Any] = {}
+
+    if path:
+        try:
+            with open(path, encoding='utf-8') as f:
+                file_values = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            raise ConfigError(f"Не удалось прочитать файл настроек {path}: {e}") from e
+
+        unknown = set(file_values) - known
+        if unknown:
+            raise ConfigError(f"Неизвестные параметры в {path}: {', '.join(sorted(unknown))}")
+        values.update(file_values)
+
+    for name in known:
+        env_name = f'{ENV_PREFIX}{name.upper()}'
+        if env_name in environ:
+            values[name] = environ[env_name]
+
+    settings = replace(defaults, **{
+        name: _convert(name, value, getattr(defaults, name)) for name, value in values.items()
+    })
+    settings.validate()
+    return settings
+
+# Текущие настройки процесса
+_settings = Settings()
+
+def get_settings() -> Settings:
+    """
+    Возвращает текущие настройки
+    """
+    return _settings
+
+def set_settings(settings: Settings) -> None:
+    """
+    Устанавливает настройки процесса (вызывается при запуске)
+    """
+    global _settings
+    _settings = settings
@@ -0,0 +1,1075 @@
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Set, Tuple, Iterator, Callable
+
+from config import Settings, get_settings
+from models import (
+    AuditEntry, Cart, Order, OrderStatus, OrderSummary, Product, Warehouse, WarehouseStock,
+    audit_entry_row, can_change_status, order_item_row, order_row, order_summary_row, product_row,
+    warehouse_row, warehouse_stock_row
+)
+
+logger = logging.getLogger(__name__)
+
+class InvalidStatusTransition(ValueError):
+    """
+    Переход заказа в указанный статус не допускается жизненным циклом заказа
+    """
+    def __init__(self, order_id: int, old_status: int, new_status: int):
+        super().__init__(f"Заказ {order_id}: переход из статуса {old_status} в {new_status} недопустим")
+        self.order_id = order_id
+        self.old_status = OrderStatus(old_status)
+        self.new_status = OrderStatus(new_status)
+
+# Пул соединений
+class ConnectionPool:
+    """
+    Пул соединений SQLite. Соединения создаются по мере необходимости,
+    но не больше size; при исчерпании пула запрос ждет освобождения
+    """
+    def __init__(self, path: str, size: int, timeout: float = 30.0):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        if _statement_hook is not None:
+            conn.set_trace_callback(_statement_hook)
+        # WAL позволяет читателям не блокироваться на время записи
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self._connect()
+        return self._idle.get(timeout=self.timeout)
+
+    def release(self, conn: sqlite3.Connection) -> None:
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def take_idle(self, exclude: Set[int]) -> Optional[sqlite3.Connection]:
+        """
+        Забирает свободное соединение, id которого нет в exclude, не дожидаясь
+        освобождения занятых (его нужно вернуть через release). Остальные
+        свободные соединения сразу возвращаются в пул
+        """
+        skipped = []
+        try:
+            while True:
+                try:
+                    conn = self._idle.get_nowait()
+                except queue.Empty:
+                    return None
+                if id(conn) not in exclude:
+                    return conn
+                skipped.append(conn)
+        finally:
+            for conn in skipped:
+                self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+        self._created = 0
+
+_pool: Optional[ConnectionPool] = None
+
+# Получатель текста каждого выполненного запроса (для профилирования)
+_statement_hook: Optional[Callable[[str], None]] = None
+
+def set_statement_hook(hook: Optional[Callable[[str], None]]) -> None:
+    """
+    Задает функцию, вызываемую для каждого запроса к базе. Действует
+    на соединения, созданные после вызова (см. configure_database)
+    """
+    global _statement_hook
+    _statement_hook = hook
+
+def configure_database(settings: Settings) -> None:
+    """
+    Создает пул соединений и кэш товаров согласно настройкам
+    """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+    _pool = ConnectionPool(settings.db_path, settings.db_pool_size)
+    _product_cache.ttl = settings.product_cache_ttl
+    _product_cache.invalidate()
+
+def close_database() -> None:
+    """
+    Закрывает все соединения пула
+    """
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+@contextmanager
+def connect() -> Iterator[sqlite3.Connection]:
+    """
+    Выдает соединение из пула и возвращает его обратно после использования.
+    Незафиксированная транзакция откатывается
+    """
+    if _pool is None:
+        configure_database(get_settings())
+    conn = _pool.acquire()
+    try:
+        yield conn
+    finally:
+        _pool.release(conn)
+
+# Кэш каталога
+class ProductCache:
+    """
+    Кэш списка товаров с ограниченным временем жизни.
+    Сбрасывается при любом изменении товаров из этого процесса
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._products: Optional[List[Product]] = None
+        self._by_id: Dict[int, Product] = {}
+        self._expires_at = 0.0
+        # Остатки по складам для /stock; живут столько же, сколько список товаров
+        self.stock_breakdown: Optional[Dict[int, Tuple[WarehouseStock, ...]]] = None
+
+    def get(self) -> Optional[List[Product]]:
+        if self._products is not None and time.monotonic() < self._expires_at:
+            return self._products
+        return None
+
+    def get_by_id(self, product_id: int) -> Optional[Product]:
+        if self.get() is None:
+            return None
+        return self._by_id.get(product_id)
+
+    def set(self, products: List[Product]) -> None:
+        if self.ttl <= 0:
+            return
+        self._products = products
+        self._by_id = {p.id: p for p in products}
+        self._expires_at = time.monotonic() + self.ttl
+        self.stock_breakdown = None
+
+    def invalidate(self) -> None:
+        self._products = None
+        self._by_id = {}
+        self.stock_breakdown = None
+
+_product_cache = ProductCache(get_settings().product_cache_ttl)
+
+# Журнал изменений
+# Событие: (entity, entity_id, field, actor_id, created_at, old_value, new_value, warehouse_id)
+AuditEvent = Tuple[str, int, str, Optional[int], str, Any, Any, Optional[int]]
+
+_audit_sink: Optional[Callable[[List[AuditEvent]], None]] = None
+
+def set_audit_sink(sink: Optional[Callable[[List[AuditEvent]], None]]) -> None:
+    """
+    Задает получателя событий журнала. Без получателя события
+    записываются в той же транзакции, что и само изменение
+    """
+    global _audit_sink
+    _audit_sink = sink
+
+def _now() -> str:
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+def _write_audit_inline(cursor: sqlite3.Cursor, events: List[AuditEvent]) -> None:
+    """
+    Записывает события в текущей транзакции, если нет фонового получателя
+    """
+    if _audit_sink is None and events:
+        insert_audit_events(events, cursor)
+
+def _publish_audit(events: List[AuditEvent]) -> None:
+    """
+    Передает события фоновому получателю после фиксации транзакции
+    """
+    if _audit_sink is not None and events:
+        _audit_sink(events)
+
+# Схема базы данных
+def _migrate_v1(cursor: sqlite3.Cursor) -> None:
+    """
+    Создает исходные таблицы магазина
+    """
+    # Создание таблицы товаров
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS products (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT,
+        price REAL NOT NULL,
+        stock INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    
+    # Создание таблицы заказов
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS orders (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        order_date TEXT NOT NULL,
+        status TEXT NOT NULL,
+        total_price REAL NOT NULL,
+        idempotency_key TEXT
+    )
+    ''')
+
+    # Добавление ключа идемпотентности в базы, созданные до его появления
+    cursor.execute('PRAGMA table_info(orders)')
+    if 'idempotency_key' not in [column[1] for column in cursor.fetchall()]:
+        cursor.execute('ALTER TABLE orders ADD COLUMN idempotency_key TEXT')
+
+    # Уникальный индекс защищает от повторного оформления одной и той же корзины
+    cursor.execute(
+        'CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_idempotency_key ON orders (idempotency_key)'
+    )
+
+    # Создание таблицы позиций заказа
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS order_items (
+        id INTEGER PRIMARY KEY,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        price REAL NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id),
+        FOREIGN KEY (product_id) REFERENCES products (id)
+    )
+    ''')
+    
+    # Создание таблицы пользователей
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER UNIQUE NOT NULL,
+        username TEXT,
+        full_name TEXT,
+        is_admin INTEGER DEFAULT 0
+    )
+    ''')
+
+# Миграции схемы по порядку; номер версии равен количеству примененных миграций
+def _migrate_v2(cursor: sqlite3.Cursor) -> None:
+    """
+    Создает журнал изменений остатков и статусов заказов
+    """
+    # Журнал только дополняется; old_value и new_value без типа,
+    # чтобы хранить и количества, и статусы как есть
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS audit_log (
+        id INTEGER PRIMARY KEY,
+        entity TEXT NOT NULL,
+        entity_id INTEGER NOT NULL,
+        field TEXT NOT NULL,
+        actor_id INTEGER,
+        created_at TEXT NOT NULL,
+        old_value,
+        new_value
+    )
+    ''')
+    
+    # История по товару или заказу читается от новых записей к старым
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_audit_log_entity ON audit_log (entity, entity_id, id)'
+    )
+
+# Прежние текстовые статусы заказов и их коды
+_LEGACY_STATUS_CODES = {
+    'Новый': OrderStatus.NEW,
+    'В обработке': OrderStatus.PROCESSING,
+    'Отправлен': OrderStatus.SHIPPED,
+    'Доставлен': OrderStatus.DELIVERED,
+    'Отменен': OrderStatus.CANCELLED,
+}
+
+def _legacy_status_case(column: str) -> str:
+    """
+    SQL-выражение, переводящее текстовый статус из столбца в код
+    """
+    return f'CASE {column} ' + ' '.join(
+        f"WHEN '{title}' THEN {int(code)}" for title, code in _LEGACY_STATUS_CODES.items()
+    ) + f' ELSE {int(OrderStatus.NEW)} END'
+
+def _migrate_v3(cursor: sqlite3.Cursor) -> None:
+    """
+    Переводит статусы заказов из текста в числовые коды
+    и добавляет индексы для фильтра по статусу и позиций заказа
+    """
+    # SQLite не меняет тип столбца, поэтому таблица заказов пересоздается
+    cursor.execute('''
+    CREATE TABLE orders_new (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        order_date TEXT NOT NULL,
+        status INTEGER NOT NULL DEFAULT 0,
+        total_price REAL NOT NULL,
+        idempotency_key TEXT
+    )
+    ''')
+    cursor.execute(f'''
+    INSERT INTO orders_new (id, user_id, order_date, status, total_price, idempotency_key)
+    SELECT id, user_id, order_date, {_legacy_status_case('status')}, total_price, idempotency_key FROM orders
+    ''')
+    cursor.execute('DROP TABLE orders')
+    cursor.execute('ALTER TABLE orders_new RENAME TO orders')
+    cursor.execute(
+        'CREATE UNIQUE INDEX idx_orders_idempotency_key ON orders (idempotency_key)'
+    )
+    
+    # Фильтр по статусу - поиск по индексу, заказы внутри статуса уже упорядочены по дате
+    cursor.execute('CREATE INDEX idx_orders_status_date ON orders (status, order_date)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)')
+    
+    # Статусы в журнале изменений тоже хранятся кодами
+    cursor.execute(f'''
+    UPDATE audit_log SET
+        old_value = CASE WHEN old_value IS NULL THEN NULL ELSE {_legacy_status_case('old_value')} END,
+        new_value = {_legacy_status_case('new_value')}
+    WHERE entity = 'order' AND field = 'status'
+    ''')
+
+# Склад, на который переносятся остатки при переходе на несколько складов
+DEFAULT_WAREHOUSE_ID = 1
+
+def _migrate_v4(cursor: sqlite3.Cursor) -> None:
+    """
+    Добавляет склады и остатки товаров по складам. products.stock
+    остается суммой остатков по всем складам и обновляется триггерами
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS warehouses (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    cursor.execute(
+        'INSERT OR IGNORE INTO warehouses (id, name, priority) VALUES (?, ?, 0)',
+        (DEFAULT_WAREHOUSE_ID, 'Основной склад')
+    )
+    
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS product_stock (
+        product_id INTEGER NOT NULL,
+        warehouse_id INTEGER NOT NULL,
+        qty INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (product_id, warehouse_id),
+        FOREIGN KEY (product_id) REFERENCES products (id),
+        FOREIGN KEY (warehouse_id) REFERENCES warehouses (id)
+    ) WITHOUT ROWID
+    ''')
+    
+    # Текущие остатки переносятся на основной склад до создания триггеров,
+    # чтобы не учесть их в общем остатке повторно
+    cursor.execute(
+        'INSERT INTO product_stock (product_id, warehouse_id, qty) SELECT id, ?, stock FROM products',
+        (DEFAULT_WAREHOUSE_ID,)
+    )
+    
+    # Общий остаток меняется на разницу при каждом изменении остатка на складе
+    cursor.execute('''
+    CREATE TRIGGER product_stock_insert AFTER INSERT ON product_stock BEGIN
+        UPDATE products SET stock = stock + NEW.qty WHERE id = NEW.product_id;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER product_stock_update AFTER UPDATE OF qty ON product_stock BEGIN
+        UPDATE products SET stock = stock + NEW.qty - OLD.qty WHERE id = NEW.product_id;
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER product_stock_delete AFTER DELETE ON product_stock BEGIN
+        UPDATE products SET stock = stock - OLD.qty WHERE id = OLD.product_id;
+    END
+    ''')
+    
+    # С каких складов списан товар заказа: при отмене он возвращается туда же
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS order_allocations (
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        warehouse_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        FOREIGN KEY (order_id) REFERENCES orders (id)
+    )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_order_allocations_order ON order_allocations (order_id)'
+    )
+
+def _migrate_v5(cursor: sqlite3.Cursor) -> None:
+    """
+    Добавляет склад в журнал изменений: ручное изменение остатка
+    записывается и для общего остатка, и для остатка на складе
+    """
+    cursor.execute('ALTER TABLE audit_log ADD COLUMN warehouse_id INTEGER')
+
+MIGRATIONS = [
+    _migrate_v1,
+    _migrate_v2,
+    _migrate_v3,
+    _migrate_v4,
+    _migrate_v5,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Инициализация базы данных
+def init_db(admin_id: int) -> None:
+    """
+    Приводит схему базы данных к актуальной версии.
+    Версия хранится в PRAGMA user_version, поэтому при актуальной схеме
+    DDL не выполняется. Также назначает администратора
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        # Миграции и номер версии фиксируются вместе одной транзакцией
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('PRAGMA user_version')
+        version = cursor.fetchone()[0]
+        
+        if version < SCHEMA_VERSION:
+            for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {number}')
+            logger.info(f"Схема базы данных обновлена с версии {version} до {SCHEMA_VERSION}")
+        
+        # Установка статуса администратора
+        cursor.execute('INSERT OR IGNORE INTO users (user_id, is_admin) VALUES (?, 1)', (admin_id,))
+        
+        conn.commit()
+    logger.info("База данных инициализирована")
+
+def seed_sample_products() -> int:
+    """
+    Добавляет тестовые товары, если таблица товаров пуста.
+    Возвращает количество добавленных товаров
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('SELECT COUNT(*) FROM products')
+        if cursor.fetchone()[0] > 0:
+            return 0
+        
+        sample_products = [
+            ('Футболка', 'Хлопковая футболка, размеры S-XL', 550.00, 50),
+            ('Джинсы', 'Классические джинсы, размеры 28-36', 1099.00, 30),
+            ('Кроссовки', 'Спортивные кроссовки, размеры 36-45', 1850.00, 25),
+            ('Куртка', 'Демисезонная куртка, размеры S-XXL', 2200.00, 15),
+            ('Шапка', 'Теплая зимняя шапка', 450.00, 40)
+        ]
+        for name, description, price, stock in sample_products:
+            cursor.execute(
+                'INSERT INTO products (name, description, price) VALUES (?, ?, ?)',
+                (name, description, price)
+            )
+            # Общий остаток товара заполняется триггером
+            cursor.execute(
+                'INSERT INTO product_stock (product_id, warehouse_id, qty) VALUES (?, ?, ?)',
+                (cursor.lastrowid, DEFAULT_WAREHOUSE_ID, stock)
+            )
+        
+        conn.commit()
+    _product_cache.invalidate()
+    logger.info(f"Добавлено тестовых товаров: {len(sample_products)}")
+    return len(sample_products)
+
+# Вспомогательные функции для работы с базой данных
+def get_products() -> List[Product]:
+    """
+    Получает список всех товаров (из кэша, если он не устарел)
+    """
+    products = _product_cache.get()
+    if products is not None:
+        return products
+    
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = product_row
+        cursor.execute('SELECT id, name, description, price, stock FROM products')
+        products = cursor.fetchall()
+    _product_cache.set(products)
+    return products
+
+def refresh_product_cache() -> int:
+    """
+    Перечитывает каталог и остатки по складам в кэш заранее, чтобы
+    обработчики не ждали базу после истечения срока кэша.
+    Возвращает число товаров
+    """
+    _product_cache.invalidate()
+    products = get_products()
+    get_stock_breakdown()
+    return len(products)
+
+def get_product_by_id(product_id: int) -> Optional[Product]:
+    """
+    Получает товар по его ID
+    """
+    product = _product_cache.get_by_id(product_id)
+    if product is not None:
+        return product
+    
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = product_row
+        cursor.execute('SELECT id, name, description, price, stock FROM products WHERE id = ?', (product_id,))
+        return cursor.fetchone()
+
+def get_stock_breakdown() -> Dict[int, Tuple[WarehouseStock, ...]]:
+    """
+    Остатки товаров по складам (ID товара -> остатки на складах). Кэшируется
+    вместе со списком товаров, поэтому /stock не обращается к базе повторно
+    """
+    products = get_products()
+    breakdown = _product_cache.stock_breakdown
+    if breakdown is not None and _product_cache.get() is products:
+        return breakdown
+    
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = None
+        cursor.execute(
+            '''
+            SELECT ps.product_id, ps.warehouse_id, w.name, ps.qty
+            FROM product_stock ps
+            JOIN warehouses w ON ps.warehouse_id = w.id
+            ORDER BY ps.product_id, w.priority, w.id
+            '''
+        )
+        grouped: Dict[int, List[WarehouseStock]] = {}
+        for product_id, warehouse_id, name, qty in cursor.fetchall():
+            grouped.setdefault(product_id, []).append(WarehouseStock(warehouse_id, name, qty))
+    
+    breakdown = {product_id: tuple(stock) for product_id, stock in grouped.items()}
+    if _product_cache.get() is products:
+        _product_cache.stock_breakdown = breakdown
+    return breakdown
+
+def get_product_stock(product_id: int) -> List[WarehouseStock]:
+    """
+    Остатки товара на каждом складе, включая склады без этого товара
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = warehouse_stock_row
+        cursor.execute(
+            '''
+            SELECT w.id, w.name, COALESCE(ps.qty, 0)
+            FROM warehouses w
+            LEFT JOIN product_stock ps ON ps.warehouse_id = w.id AND ps.product_id = ?
+            ORDER BY w.priority, w.id
+            ''',
+            (product_id,)
+        )
+        return cursor.fetchall()
+
+def get_warehouses() -> List[Warehouse]:
+    """
+    Получает список складов, от ближайших к дальним
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = warehouse_row
+        cursor.execute('SELECT id, name, priority FROM warehouses ORDER BY priority, id')
+        return cursor.fetchall()
+
+def add_warehouse(name: str, priority: int = 0) -> int:
+    """
+    Добавляет склад, возвращает его ID
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO warehouses (name, priority) VALUES (?, ?)', (name, priority))
+        conn.commit()
+    _product_cache.invalidate()
+    logger.info(f"Добавлен склад '{name}' (приоритет {priority})")
+    return cursor.lastrowid
+
+def update_product_stock(product_id: int, new_stock: int, actor_id: Optional[int] = None,
+                         warehouse_id: int = DEFAULT_WAREHOUSE_ID) -> None:
+    """
+    Обновляет количество товара на складе. Общий остаток товара
+    пересчитывается триггером
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        # Блокировка на запись сразу, чтобы прежнее значение в журнале было точным
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT stock FROM products WHERE id = ?', (product_id,))
+        row = cursor.fetchone()
+        cursor.execute(
+            'SELECT qty FROM product_stock WHERE product_id = ? AND warehouse_id = ?',
+            (product_id, warehouse_id)
+        )
+        old_qty = cursor.fetchone()
+        cursor.execute(
+            '''
+            INSERT INTO product_stock (product_id, warehouse_id, qty) VALUES (?, ?, ?)
+            ON CONFLICT (product_id, warehouse_id) DO UPDATE SET qty = excluded.qty
+            ''',
+            (product_id, warehouse_id, new_stock)
+        )
+        cursor.execute('SELECT stock FROM products WHERE id = ?', (product_id,))
+        new_total = cursor.fetchone()
+        
+        events = []
+        if row and new_total and row[0] != new_total[0]:
+            now = _now()
+            events.append(('product', product_id, 'stock', actor_id, now, row[0], new_total[0], None))
+            events.append(('product', product_id, 'warehouse_stock', actor_id, now,
+                           old_qty[0] if old_qty else 0, new_stock, warehouse_id))
+        _write_audit_inline(cursor, events)
+        conn.commit()
+    _publish_audit(events)
+    _product_cache.invalidate()
+    logger.info(f"Обновлен запас товара с ID {product_id} на складе {warehouse_id}: {new_stock}")
+
+# Порядок складов для списания товара по каждой стратегии
+_ALLOCATION_ORDER = {
+    'nearest': 'w.priority, w.id',
+    'most_stocked': 'ps.qty DESC, w.priority, w.id',
+}
+
+def _allocate_stock(cursor: sqlite3.Cursor, product_id: int, quantity: int,
+                    strategy: str) -> List[Tuple[int, int]]:
+    """
+    Распределяет количество товара по складам согласно стратегии.
+    Возвращает пары (ID склада, количество)
+    """
+    cursor.execute(
+        f'''
+        SELECT ps.warehouse_id, ps.qty
+        FROM product_stock ps
+        JOIN warehouses w ON ps.warehouse_id = w.id
+        WHERE ps.product_id = ? AND ps.qty > 0
+        ORDER BY {_ALLOCATION_ORDER[strategy]}
+        ''',
+        (product_id,)
+    )
+    allocation = []
+    remaining = quantity
+    for warehouse_id, qty in cursor.fetchall():
+        take = min(qty, remaining)
+        allocation.append((warehouse_id, take))
+        remaining -= take
+        if not remaining:
+            break
+    
+    # Недостающее количество, как и раньше с общим остатком,
+    # списывается в минус - с первого подходящего склада
+    if remaining:
+        if allocation:
+            warehouse_id, take = allocation[0]
+            allocation[0] = (warehouse_id, take + remaining)
+        else:
+            allocation.append((DEFAULT_WAREHOUSE_ID, remaining))
+    return allocation
+
+def _add_stock(cursor: sqlite3.Cursor, changes: List[Tuple[int, int, int]]) -> None:
+    """
+    Изменяет остатки на складах на величину delta: (ID товара, ID склада, delta)
+    """
+    cursor.executemany(
+        '''
+        INSERT INTO product_stock (product_id, warehouse_id, qty) VALUES (?, ?, ?)
+        ON CONFLICT (product_id, warehouse_id) DO UPDATE SET qty = qty + excluded.qty
+        ''',
+        changes
+    )
+
+def create_order(user_id: int, cart: Cart, total_price: float) -> Tuple[int, bool]:
+    """
+    Создает новый заказ и добавляет товары из корзины.
+    Ключ корзины служит ключом идемпотентности: повторное оформление той же
+    корзины не создает новый заказ, а возвращает уже существующий.
+    Возвращает (ID заказа, создан ли заказ сейчас)
+    """
+    idempotency_key = cart.key
+    with connect() as conn:
+        cursor = conn.cursor()
+        
+        # Корзина уже была оформлена - повторяем ответ без записи
+        if idempotency_key:
+            existing = _find_order_by_idempotency_key(cursor, idempotency_key)
+            if existing:
+                logger.info(f"Повторное оформление корзины {idempotency_key}, заказ {existing}")
+                return existing, False
+        
+        # Создание заказа
+        order_date = _now()
+        try:
+            cursor.execute(
+                'INSERT INTO orders (user_id, order_date, status, total_price, idempotency_key) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (user_id, order_date, OrderStatus.NEW, total_price, idempotency_key)
+            )
+        except sqlite3.IntegrityError:
+            # Параллельный запрос успел оформить ту же корзину раньше
+            conn.rollback()
+            return _find_order_by_idempotency_key(cursor, idempotency_key), False
+        order_id = cursor.lastrowid
+        events = [('order', order_id, 'status', user_id, order_date, None, int(OrderStatus.NEW), None)]
+        
+        # Добавление позиций заказа и списание товара со складов
+        strategy = get_settings().stock_allocation
+        for product_id, quantity in cart.items():
+            cursor.execute('SELECT price, stock FROM products WHERE id = ?', (product_id,))
+            product = cursor.fetchone()
+            if product:
+                price, stock = product
+                cursor.execute(
+                    'INSERT INTO order_items (order_id, product_id, quantity, price) VALUES (?, ?, ?, ?)',
+                    (order_id, product_id, quantity, price)
+                )
+                
+                # Обновление запасов; общий остаток пересчитывается триггером
+                allocation = _allocate_stock(cursor, product_id, quantity, strategy)
+                _add_stock(cursor, [(product_id, warehouse_id, -qty) for warehouse_id, qty in allocation])
+                cursor.executemany(
+                    'INSERT INTO order_allocations (order_id, product_id, warehouse_id, quantity) VALUES (?, ?, ?, ?)',
+                    [(order_id, product_id, warehouse_id, qty) for warehouse_id, qty in allocation]
+                )
+                events.append(('product', product_id, 'stock', user_id, order_date, stock, stock - quantity, None))
+        
+        _write_audit_inline(cursor, events)
+        conn.commit()
+    _publish_audit(events)
+    _product_cache.invalidate()
+    logger.info(f"Создан заказ {order_id} для пользователя {user_id}")
+    
+    return order_id, True
+
+def _find_order_by_idempotency_key(cursor: sqlite3.Cursor, idempotency_key: str) -> Optional[int]:
+    """
+    Ищет заказ, оформленный с указанным ключом идемпотентности
+    """
+    cursor.execute('SELECT id FROM orders WHERE idempotency_key = ?', (idempotency_key,))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+def find_order_by_idempotency_key(idempotency_key: str) -> Optional[int]:
+    """
+    ID заказа, уже оформленного из корзины с этим ключом, или None
+    """
+    with connect() as conn:
+        return _find_order_by_idempotency_key(conn.cursor(), idempotency_key)
+
+def get_order_status(order_id: int, user_id: int) -> Optional[OrderStatus]:
+    """
+    Получает статус заказа
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            'SELECT status FROM orders WHERE id = ? AND user_id = ?',
+            (order_id, user_id)
+        )
+        result = cursor.fetchone()
+    
+    if result:
+        return OrderStatus(result[0])
+    return None
+
+def get_order_details(order_id: int) -> Optional[Order]:
+    """
+    Получает детали заказа: информацию о заказе, покупателе и товарах в нем
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        
+        # Получение информации о заказе
+        cursor.row_factory = order_row
+        cursor.execute(
+            'SELECT id, user_id, order_date, status, total_price FROM orders WHERE id = ?',
+            (order_id,)
+        )
+        order = cursor.fetchone()
+        
+        if not order:
+            return None
+        
+        # Получение информации о пользователе
+        cursor.row_factory = None
+        cursor.execute(
+            'SELECT username, full_name FROM users WHERE user_id = ?',
+            (order.user_id,)
+        )
+        order.username, order.full_name = cursor.fetchone() or ("Неизвестно", "Неизвестный пользователь")
+        
+        # Получение товаров в заказе
+        cursor.row_factory = order_item_row
+        cursor.execute(
+            '''
+            SELECT p.name, oi.quantity, oi.price
+            FROM order_items oi
+            JOIN products p ON oi.product_id = p.id
+            WHERE oi.order_id = ?
+            ''',
+            (order_id,)
+        )
+        order.items = tuple(cursor.fetchall())
+    
+    return order
+
+def get_all_orders(limit: Optional[int] = None, status_filter: Optional[int] = None) -> List[OrderSummary]:
+    """
+    Получает список всех заказов, опционально фильтруя по статусу.
+    По умолчанию возвращает одну страницу из настроек (orders_page_size)
+    """
+    if limit is None:
+        limit = get_settings().orders_page_size
+    
+    # Сначала выбирается страница заказов, затем для каждого считаются позиции,
+    # поэтому фильтр по статусу и сортировка по дате идут по индексу
+    query = '''
+    SELECT o.id, u.full_name, o.order_date, o.status, o.total_price,
+        (SELECT COUNT(*) FROM order_items oi WHERE oi.order_id = o.id) as items_count
+    FROM orders o
+    LEFT JOIN users u ON o.user_id = u.user_id
+    '''
+    
+    params = []
+    if status_filter is not None:
+        query += ' WHERE o.status = ?'
+        params.append(status_filter)
+    
+    query += '''
+    ORDER BY o.order_date DESC
+    LIMIT ?
+    '''
+    params.append(limit)
+    
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = order_summary_row
+        cursor.execute(query, params)
+        return cursor.fetchall()
+
+def update_order_status(order_id: int, new_status: int, actor_id: Optional[int] = None) -> bool:
+    """
+    Обновляет статус заказа с проверкой допустимости перехода.
+    При отмене заказа товары возвращаются на склад в той же транзакции.
+    Возвращает False, если заказ не найден; при недопустимом переходе
+    вызывает InvalidStatusTransition
+    """
+    new_status = OrderStatus(new_status)
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        cursor.execute('SELECT status FROM orders WHERE id = ?', (order_id,))
+        row = cursor.fetchone()
+        if not row:
+            return False
+        
+        old_status = row[0]
+        if not can_change_status(old_status, new_status):
+            raise InvalidStatusTransition(order_id, old_status, new_status)
+        
+        cursor.execute('UPDATE orders SET status = ? WHERE id = ?', (new_status, order_id))
+        now = _now()
+        events = [('order', order_id, 'status', actor_id, now, old_status, int(new_status), None)]
+        
+        # Возврат товаров отмененного заказа на те склады, с которых они списаны
+        restocked = []
+        if new_status == OrderStatus.CANCELLED:
+            restocked = _restock_order(cursor, order_id)
+            events.extend(
+                ('product', product_id, 'stock', actor_id, now, old_stock, new_stock, None)
+                for product_id, old_stock, new_stock in restocked
+            )
+        
+        _write_audit_inline(cursor, events)
+        conn.commit()
+    _publish_audit(events)
+    
+    if restocked:
+        _product_cache.invalidate()
+    logger.info(f"Обновлен статус заказа {order_id}: {old_status} -> {int(new_status)}")
+    
+    return True
+
+def _restock_order(cursor: sqlite3.Cursor, order_id: int) -> List[Tuple[int, int, int]]:
+    """
+    Возвращает товары заказа на склады. Заказы, оформленные до появления
+    складов, возвращаются на основной склад. Возвращает тройки
+    (ID товара, прежний общий остаток, новый общий остаток)
+    """
+    cursor.execute(
+        'SELECT product_id, warehouse_id, quantity FROM order_allocations WHERE order_id = ?',
+        (order_id,)
+    )
+    changes = cursor.fetchall()
+    if not changes:
+        cursor.execute(
+            'SELECT product_id, ?, quantity FROM order_items WHERE order_id = ?',
+            (DEFAULT_WAREHOUSE_ID, order_id)
+        )
+        changes = cursor.fetchall()
+    if not changes:
+        return []
+    
+    product_ids = sorted({product_id for product_id, _, _ in changes})
+    placeholders = ','.join('?' * len(product_ids))
+    query = f'SELECT id, stock FROM products WHERE id IN ({placeholders})'
+    
+    cursor.execute(query, product_ids)
+    old_stock = dict(cursor.fetchall())
+    _add_stock(cursor, changes)
+    cursor.execute(query, product_ids)
+    new_stock = dict(cursor.fetchall())
+    
+    return [
+        (product_id, old_stock[product_id], new_stock[product_id])
+        for product_id in product_ids if product_id in old_stock
+    ]
+
+def upsert_users(users: List[Tuple[int, Optional[str], str]]) -> None:
+    """
+    Регистрирует пользователей или обновляет их username и имя одной транзакцией.
+    Строки без изменений не перезаписываются
+    """
+    with connect() as conn:
+        conn.executemany(
+            '''
+            INSERT INTO users (user_id, username, full_name) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = excluded.username,
+                full_name = excluded.full_name
+            WHERE username IS NOT excluded.username OR full_name IS NOT excluded.full_name
+            ''',
+            users
+        )
+        conn.commit()
+
+def is_admin(user_id: int) -> bool:
+    """
+    Проверяет, является ли пользователь администратором
+    """
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.execute('SELECT is_admin FROM users WHERE user_id = ?', (user_id,))
+        result = cursor.fetchone()
+    
+    if result and result[0] == 1:
+        return True
+    return False
+
+def insert_audit_events(events: List[AuditEvent], cursor: Optional[sqlite3.Cursor] = None) -> None:
+    """
+    Добавляет события в журнал изменений. Без курсора пишет
+    отдельной транзакцией
+    """
+    query = '''
+    INSERT INTO audit_log (entity, entity_id, field, actor_id, created_at, old_value, new_value, warehouse_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    if cursor is not None:
+        cursor.executemany(query, events)
+        return
+    
+    with connect() as conn:
+        conn.executemany(query, events)
+        conn.commit()
+
+def get_audit_history(entity: str, entity_id: int, limit: Optional[int] = None) -> List[AuditEntry]:
+    """
+    Получает последние изменения товара или заказа, от новых к старым
+    """
+    if limit is None:
+        limit = get_settings().audit_history_limit
+    
+    with connect() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = audit_entry_row
+        cursor.execute(
+            '''
+            SELECT a.created_at, a.field, a.old_value, a.new_value, a.actor_id, u.full_name, w.name
+            FROM audit_log a
+            LEFT JOIN users u ON a.actor_id = u.user_id
+            LEFT JOIN warehouses w ON a.warehouse_id = w.id
+            WHERE a.entity = ? AND a.entity_id = ?
+            ORDER BY a.id DESC
+            LIMIT ?
+            ''',
+            (entity, entity_id, limit)
+        )
+        return cursor.fetchall()
+
+# Обслуживание базы данных
+def optimize_database() -> int:
+    """
+    Выполняет PRAGMA optimize на свободных соединениях пула. SQLite
+    обновляет статистику планировщика запросов для таблиц, которыми
+    пользовалось соединение, поэтому проходим по всем соединениям.
+    Соединения берутся по одному и сразу возвращаются, чтобы обработчикам
+    не приходилось ждать освобождения пула. Возвращает число обработанных
+    соединений
+    """
+    if _pool is None:
+        configure_database(get_settings())
+    pool = _pool
+    done: Set[int] = set()
+    while True:
+        conn = pool.take_idle(done)
+        if conn is None:
+            return len(done)
+        done.add(id(conn))
+        try:
+            # Ограничение числа строк, просматриваемых ANALYZE на каждом индексе
+            conn.execute('PRAGMA analysis_limit=400')
+            conn.execute('PRAGMA optimize')
+        finally:
+            pool.release(conn)
+
+def compact_database(min_free_ratio: float, vacuum: bool = True) -> int:
+    """
+    Переносит журнал WAL в базу. Если свободных страниц не меньше
+    min_free_ratio от размера базы и vacuum, выполняет VACUUM.
+    VACUUM и усечение журнала блокируют запись в базу, поэтому пока бот
+    получает обновления, вызывается с vacuum=False: журнал переносится
+    без ожидания обработчиков, а сжатие откладывается до запуска бота.
+    Возвращает число освобожденных страниц
+    """
+    with connect() as conn:
+        conn.execute(f"PRAGMA wal_checkpoint({'TRUNCATE' if vacuum else 'PASSIVE'})")
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        if not page_count or freelist_count / page_count < min_free_ratio:
+            return 0
+        if not vacuum:
+            logger.info(f"Свободных страниц {freelist_count} из {page_count}, "
+                        f"база будет сжата при следующем запуске бота")
+            return 0
+
+        started = time.perf_counter()
+        conn.execute('VACUUM')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        freed = page_count - conn.execute('PRAGMA page_count').fetchone()[0]
+    logger.info(f"База данных сжата: освобождено страниц {freed} из {page_count} "
+                f"за {time.perf_counter() - started:.2f} с")
+    return freed
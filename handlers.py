@@ -0,0 +1,677 @@
+import logging
+import time
+import uuid
+from typing import Optional
+
+from aiogram import Dispatcher, Router
+from aiogram.filters import Command, CommandStart
+from aiogram.filters.state import State, StatesGroup
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import Message, CallbackQuery
+
+from callbacks import (
+    ADD_TO_CART, CART, FILTER_ORDERS, ORDER_STATUS, QUANTITY, UPDATE_STOCK, WAREHOUSE_STOCK,
+    CallbackTable
+)
+from config import get_settings
+from database import (
+    get_products, get_product_by_id, update_product_stock, create_order, find_order_by_idempotency_key,
+    get_order_status, get_order_details, get_all_orders, update_order_status,
+    is_admin, get_audit_history, get_stock_breakdown, get_product_stock,
+    InvalidStatusTransition, DEFAULT_WAREHOUSE_ID
+)
+from models import Cart, OrderStatus, Product, WarehouseStock
+from middlewares import DeduplicationMiddleware, ThrottlingMiddleware, UpdateTracker, UserRegistrationMiddleware
+from writers import user_writer
+from scheduler import scheduler
+from rendering import (
+    ORDER_STATUS_TITLES, CART_KEYBOARD, ORDERS_FILTER_KEYBOARD, order_status_keyboard, quantity_keyboard,
+    render_catalog, products_keyboard, render_stock, render_cart, render_orders_list,
+    render_order_summary, render_order_details, render_history, render_jobs, warehouses_keyboard
+)
+
+logger = logging.getLogger(__name__)
+
+# Определение состояний для разных операций
+class OrderStates(StatesGroup):
+    """
+    Состояния для FSM при оформлении заказа
+    """
+    selecting_product = State()  # Выбор товара
+    selecting_quantity = State()  # Выбор количества
+    confirming_order = State()   # Подтверждение заказа
+    checking_status = State()    # Проверка статуса заказа
+
+class AdminStates(StatesGroup):
+    """
+    Состояния для FSM при работе с админскими функциями
+    """
+    updating_stock = State()             # Обновление запасов
+    selecting_product_to_update = State() # Выбор товара для обновления
+    selecting_warehouse = State()        # Выбор склада для обновления
+    entering_new_stock = State()         # Ввод нового количества
+    
+    viewing_orders = State()             # Просмотр заказов
+    viewing_order_details = State()      # Просмотр деталей заказа
+    changing_order_status = State()      # Изменение статуса заказа
+
+# Состояния, в которых пользователь вводит число (номер заказа, остаток):
+# только в них число сохраняется в записи обновлений (см. recorder.py)
+NUMERIC_INPUT_STATES = frozenset({
+    OrderStates.checking_status.state,
+    AdminStates.entering_new_stock.state,
+    AdminStates.viewing_order_details.state,
+})
+
+# Создание роутеров
+main_router = Router()
+order_router = Router()
+admin_router = Router()
+
+# Все callback-запросы маршрутизируются одной таблицей по префиксу данных кнопки
+callback_table = CallbackTable()
+main_router.callback_query.register(callback_table.dispatch)
+
+# Обработчики команд
+@main_router.message(CommandStart())
+async def cmd_start(message: Message) -> None:
+    """
+    Обработчик команды /start
+    Отправляет приветственное сообщение (пользователь регистрируется
+    UserRegistrationMiddleware при любом сообщении)
+    """
+    await message.answer(
+        f"Привет, {message.from_user.first_name}! 👋\n\n"
+        f"Добро пожаловать в наш интернет-магазин.\n"
+        f"Используйте команды:\n"
+        f"/catalog - просмотр каталога товаров\n"
+        f"/order - создать новый заказ\n"
+        f"/status - проверить статус заказа"
+    )
+    
+    # Добавление команды для администратора
+    if is_admin(message.from_user.id):
+        await message.answer(
+            f"Дополнительные команды для администратора:\n"
+            f"/stock - управление запасами товаров\n"
+            f"/orders - просмотр и управление заказами\n"
+            f"/history product|order ID - история изменений товара или заказа\n"
+            f"/jobs - фоновые задачи и время их выполнения"
+        )
+
+@main_router.message(Command('catalog'))
+async def cmd_catalog(message: Message) -> None:
+    """
+    Обработчик команды /catalog
+    Показывает список доступных товаров с описанием и ценой
+    """
+    products = get_products()
+    
+    if not products:
+        await message.answer("В каталоге пока нет товаров.")
+        return
+    
+    await message.answer(render_catalog(products), parse_mode="HTML")
+
+@order_router.message(Command('order'))
+async def cmd_order(message: Message, state: FSMContext) -> None:
+    """
+    Обработчик команды /order
+    Начинает процесс создания нового заказа
+    """
+    # Проверка наличия товаров
+    markup = products_keyboard(get_products())
+    
+    if markup is None:
+        await message.answer("Извините, но сейчас нет товаров в наличии.")
+        return
+    
+    await message.answer("Выберите товар для добавления в корзину:", reply_markup=markup)
+    await state.set_state(OrderStates.selecting_product)
+
+# Обработчик выбора товара для корзины
+@callback_table.register(ADD_TO_CART, OrderStates.selecting_product)
+async def process_add_to_cart(callback_query: CallbackQuery, state: FSMContext, product_id: int) -> None:
+    """
+    Обработчик выбора товара для добавления в корзину
+    Запрашивает количество товара
+    """
+    product = get_product_by_id(product_id)
+    
+    if not product:
+        await callback_query.answer("Товар не найден")
+        return
+    
+    # Сохранение выбранного товара в состояние
+    await state.update_data(selected_product_id=product_id)
+    data = await state.get_data()
+    if 'cart' not in data:
+        # Ключ корзины сохраняется вместе с заказом как ключ идемпотентности
+        await state.update_data(cart=Cart(uuid.uuid4().hex).dumps(), cart_updated_at=time.time())
+    
+    # Запрос количества
+    # Ограничение по настройкам или доступному количеству
+    max_quantity = min(get_settings().max_quantity_per_item, product.stock)
+    markup = quantity_keyboard(max_quantity)
+    
+    await callback_query.message.edit_text(
+        f"Выбран товар: {product.name}\nЦена: {product.price:.2f} грн.\nУкажите количество:",
+        reply_markup=markup
+    )
+    
+    await callback_query.answer()
+    await state.set_state(OrderStates.selecting_quantity)
+
+# Обработчик выбора количества
+@callback_table.register(QUANTITY, OrderStates.selecting_quantity)
+async def process_quantity_selection(callback_query: CallbackQuery, state: FSMContext, quantity: int) -> None:
+    """
+    Обработчик выбора количества товара
+    Добавляет выбранное количество в корзину
+    """
+    # Получение данных из состояния
+    data = await state.get_data()
+    product_id = data['selected_product_id']
+    product = get_product_by_id(product_id)
+    
+    if 'cart' not in data:
+        cart = Cart(uuid.uuid4().hex)
+    else:
+        cart = Cart.loads(data['cart'])
+    
+    # Добавление в корзину или обновление количества
+    cart.add(product_id, quantity)
+    
+    # Расчет итоговой суммы корзины
+    cart_total = 0
+    cart_lines = []
+    
+    for pid, qty in cart.items():
+        p = get_product_by_id(pid)
+        if p:
+            item_total = p.price * qty
+            cart_total += item_total
+            cart_lines.append((p.name, qty, item_total))
+    
+    # Обновление данных состояния
+    await state.update_data(cart=cart.dumps(), cart_total=cart_total, cart_updated_at=time.time())
+    
+    # Показ содержимого корзины и опций
+    await callback_query.message.edit_text(
+        render_cart(cart_lines, cart_total),
+        reply_markup=CART_KEYBOARD
+    )
+    
+    await callback_query.answer()
+
+# Обработчик действий с корзиной
+@callback_table.register(CART, OrderStates.selecting_quantity)
+async def process_cart_action(callback_query: CallbackQuery, state: FSMContext, action: str) -> None:
+    """
+    Обработчик действий с корзиной (добавить еще, оформить заказ, очистить)
+    """
+    if action == 'add_more':
+        # Показать каталог товаров снова
+        markup = products_keyboard(get_products())
+        
+        if markup is None:
+            await callback_query.message.edit_text("Извините, но сейчас нет товаров в наличии.")
+            await callback_query.answer()
+            return
+        
+        await callback_query.message.edit_text(
+            "Выберите товар для добавления в корзину:",
+            reply_markup=markup
+        )
+        
+        await state.set_state(OrderStates.selecting_product)
+    
+    elif action == 'checkout':
+        # Оформление заказа
+        data = await state.get_data()
+        cart = Cart.loads(data['cart'])
+        cart_total = data['cart_total']
+        
+        # Повторное нажатие: остатки уже списаны первым оформлением,
+        # поэтому заказ ищется до проверки наличия
+        existing = find_order_by_idempotency_key(cart.key) if cart.key else None
+        if existing:
+            await callback_query.answer(f"Заказ №{existing} уже оформлен")
+            await state.clear()
+            return
+        
+        # Проверка доступности товаров
+        all_available = True
+        for product_id, quantity in cart.items():
+            product = get_product_by_id(product_id)
+            if product and product.stock < quantity:
+                all_available = False
+                await callback_query.message.answer(
+                    f"Извините, товара '{product.name}' осталось только {product.stock} шт."
+                )
+        
+        if not all_available:
+            await callback_query.answer()
+            return
+        
+        # Создание заказа
+        order_id, created = create_order(
+            callback_query.from_user.id,
+            cart,
+            cart_total
+        )
+        
+        if not created:
+            # Корзина уже оформлена повторным нажатием, сообщение уже обновлено
+            await callback_query.answer(f"Заказ №{order_id} уже оформлен")
+            await state.clear()
+            return
+        
+        await callback_query.message.edit_text(
+            f"✅ Заказ №{order_id} успешно оформлен!\n"
+                            f"Сумма заказа: {cart_total:.2f} грн.\n\n"
+            f"Вы можете проверить статус заказа командой /status"
+        )
+        
+        # Очистка состояния
+        await state.clear()
+    
+    elif action == 'clear':
+        # Очистка корзины
+        await callback_query.message.edit_text(
+            "Корзина очищена. Для создания нового заказа используйте команду /order"
+        )
+        
+        await state.clear()
+    
+    await callback_query.answer()
+
+@order_router.message(Command('status'))
+async def cmd_status(message: Message, state: FSMContext) -> None:
+    """
+    Обработчик команды /status
+    Запрашивает номер заказа для проверки статуса
+    """
+    await message.answer("Введите номер заказа для проверки статуса:")
+    await state.set_state(OrderStates.checking_status)
+
+@order_router.message(OrderStates.checking_status)
+async def process_status_check(message: Message, state: FSMContext) -> None:
+    """
+    Обработчик ввода номера заказа
+    Показывает статус и детали заказа
+    """
+    try:
+        order_id = int(message.text.strip())
+    except ValueError:
+        await message.answer("Пожалуйста, введите корректный номер заказа (число).")
+        return
+    
+    # Проверка существования заказа
+    status = get_order_status(order_id, message.from_user.id)
+    
+    if status is None:
+        await message.answer("Заказ не найден или принадлежит другому пользователю.")
+        await state.clear()
+        return
+    
+    # Получение деталей заказа
+    order = get_order_details(order_id)
+    
+    if not order:
+        await message.answer("Ошибка при получении деталей заказа.")
+        await state.clear()
+        return
+    
+    await message.answer(render_order_summary(order))
+    await state.clear()
+
+@admin_router.message(Command('history'))
+async def cmd_history(message: Message) -> None:
+    """
+    Обработчик команды /history (только для администратора)
+    Показывает последние изменения остатка товара или статуса заказа
+    """
+    # Проверка прав администратора
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+    
+    args = (message.text or '').split()[1:]
+    if len(args) != 2 or args[0] not in ('product', 'order') or not args[1].isdigit():
+        await message.answer(
+            "Использование:\n"
+            "/history product ID - история остатков товара\n"
+            "/history order ID - история статусов заказа"
+        )
+        return
+    
+    entity, entity_id = args[0], int(args[1])
+    
+    if entity == 'product':
+        product = get_product_by_id(entity_id)
+        if not product:
+            await message.answer("Товар не найден")
+            return
+        title = f"товара «{product.name}»"
+    else:
+        title = f"заказа №{entity_id}"
+    
+    await message.answer(render_history(title, get_audit_history(entity, entity_id)))
+
+@admin_router.message(Command('jobs'))
+async def cmd_jobs(message: Message) -> None:
+    """
+    Обработчик команды /jobs (только для администратора)
+    Показывает расписание фоновых задач и время их выполнения
+    """
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+    
+    await message.answer(render_jobs(list(scheduler.jobs.values())), parse_mode="HTML")
+
+@admin_router.message(Command('stock'))
+async def cmd_stock(message: Message, state: FSMContext) -> None:
+    """
+    Обработчик команды /stock (только для администратора)
+    Показывает текущие запасы товаров и предлагает обновить их
+    """
+    # Проверка прав администратора
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+    
+    products = get_products()
+    
+    if not products:
+        await message.answer("В каталоге пока нет товаров.")
+        return
+    
+    # Показ текущих запасов и клавиатуры для их обновления
+    response, markup = render_stock(products, get_stock_breakdown())
+    
+    await message.answer(response, reply_markup=markup)
+    await state.set_state(AdminStates.updating_stock)
+
+@callback_table.register(UPDATE_STOCK, AdminStates.updating_stock)
+async def process_stock_update_selection(callback_query: CallbackQuery, state: FSMContext, product_id: int) -> None:
+    """
+    Обработчик выбора товара для обновления запасов
+    """
+    # Проверка прав администратора
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этой операции.")
+        return
+    
+    product = get_product_by_id(product_id)
+    
+    if not product:
+        await callback_query.answer("Товар не найден")
+        return
+    
+    # С одним складом выбирать нечего - сразу запрашиваем количество
+    stock = get_product_stock(product_id)
+    if len(stock) == 1:
+        await _ask_new_stock(callback_query, state, product, stock[0], show_warehouse=False)
+        return
+    
+    await state.update_data(update_product_id=product_id)
+    await callback_query.message.edit_text(
+        f"Товар: {product.name}\nВыберите склад:",
+        reply_markup=warehouses_keyboard(product_id, stock)
+    )
+    await callback_query.answer()
+    await state.set_state(AdminStates.selecting_warehouse)
+
+@callback_table.register(WAREHOUSE_STOCK, AdminStates.selecting_warehouse)
+async def process_warehouse_selection(callback_query: CallbackQuery, state: FSMContext,
+                                      product_id: int, warehouse_id: int) -> None:
+    """
+    Обработчик выбора склада для обновления запасов
+    """
+    # Проверка прав администратора
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этой операции.")
+        return
+    
+    product = get_product_by_id(product_id)
+    warehouse = next((s for s in get_product_stock(product_id) if s.warehouse_id == warehouse_id), None)
+    
+    if not product or not warehouse:
+        await callback_query.answer("Товар или склад не найден")
+        return
+    
+    await _ask_new_stock(callback_query, state, product, warehouse, show_warehouse=True)
+
+async def _ask_new_stock(callback_query: CallbackQuery, state: FSMContext, product: Product,
+                         warehouse: WarehouseStock, show_warehouse: bool) -> None:
+    """
+    Запрашивает новое количество товара на выбранном складе
+    """
+    # Сохранение выбранного товара и склада в состояние
+    await state.update_data(
+        update_product_id=product.id,
+        update_product_name=product.name,
+        update_warehouse_id=warehouse.warehouse_id,
+        current_stock=warehouse.qty
+    )
+    
+    warehouse_line = f"Склад: {warehouse.name}\n" if show_warehouse else ""
+    await callback_query.message.edit_text(
+        f"Товар: {product.name}\n{warehouse_line}Текущий запас: {warehouse.qty} шт.\n\n"
+        f"Введите новое количество товара на складе:"
+    )
+    
+    await callback_query.answer()
+    await state.set_state(AdminStates.entering_new_stock)
+
+@admin_router.message(AdminStates.entering_new_stock)
+async def process_new_stock_value(message: Message, state: FSMContext) -> None:
+    """
+    Обработчик ввода нового количества товара на складе
+    """
+    # Проверка прав администратора
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой операции.")
+        await state.clear()
+        return
+    
+    try:
+        new_stock = int(message.text.strip())
+        if new_stock < 0:
+            raise ValueError("Количество не может быть отрицательным")
+    except ValueError:
+        await message.answer("Пожалуйста, введите корректное количество (целое неотрицательное число).")
+        return
+    
+    # Получение данных из состояния
+    data = await state.get_data()
+    product_id = data['update_product_id']
+    product_name = data['update_product_name']
+    current_stock = data['current_stock']
+    warehouse_id = data.get('update_warehouse_id', DEFAULT_WAREHOUSE_ID)
+    
+    # Обновление запаса в базе данных
+    update_product_stock(product_id, new_stock, actor_id=message.from_user.id, warehouse_id=warehouse_id)
+    
+    await message.answer(
+        f"✅ Запас товара '{product_name}' обновлен!\n"
+        f"Было: {current_stock} шт.\n"
+        f"Стало: {new_stock} шт."
+    )
+    
+    await state.clear()
+
+@admin_router.message(Command('orders'))
+async def cmd_orders(message: Message, state: FSMContext) -> None:
+    """
+    Обработчик команды /orders (только для администратора)
+    Показывает список последних заказов с возможностью фильтрации
+    """
+    # Проверка прав администратора
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой команды.")
+        return
+    
+    await message.answer("Выберите фильтр для просмотра заказов:", reply_markup=ORDERS_FILTER_KEYBOARD)
+    await state.set_state(AdminStates.viewing_orders)
+
+@callback_table.register(FILTER_ORDERS, AdminStates.viewing_orders)
+async def process_orders_filter(callback_query: CallbackQuery, state: FSMContext,
+                                status_filter: Optional[OrderStatus]) -> None:
+    """
+    Обработчик выбора фильтра для просмотра заказов (None - все заказы)
+    """
+    # Проверка прав администратора
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этой операции.")
+        return
+    
+    # Получение заказов с выбранным фильтром
+    orders = get_all_orders(status_filter=status_filter)
+    
+    if not orders:
+        await callback_query.message.edit_text("Заказы не найдены.")
+        await callback_query.answer()
+        await state.clear()
+        return
+    
+    # Вывод списка заказов с инструкцией для просмотра деталей
+    response = render_orders_list(orders, status_filter)
+    
+    await callback_query.message.edit_text(response, parse_mode="HTML")
+    await callback_query.answer()
+    await state.set_state(AdminStates.viewing_order_details)
+
+@admin_router.message(AdminStates.viewing_order_details)
+async def process_order_details_request(message: Message, state: FSMContext) -> None:
+    """
+    Обработчик запроса деталей заказа по его номеру
+    """
+    # Проверка прав администратора
+    if not is_admin(message.from_user.id):
+        await message.answer("У вас нет прав для выполнения этой операции.")
+        await state.clear()
+        return
+    
+    try:
+        order_id = int(message.text.strip())
+    except ValueError:
+        await message.answer("Пожалуйста, введите корректный номер заказа (число).")
+        return
+    
+    # Получение деталей заказа
+    order = get_order_details(order_id)
+    
+    if not order:
+        await message.answer("Заказ с указанным номером не найден.")
+        return
+    
+    # Сохраняем ID заказа в состоянии
+    await state.update_data(current_order_id=order_id)
+    
+    await message.answer(
+        render_order_details(order),
+        reply_markup=order_status_keyboard(order_id, order.status),
+        parse_mode="HTML"
+    )
+    await state.set_state(AdminStates.changing_order_status)
+
+@callback_table.register(ORDER_STATUS, AdminStates.changing_order_status)
+async def process_status_change(callback_query: CallbackQuery, state: FSMContext,
+                                order_id: int, new_status: OrderStatus) -> None:
+    """
+    Обработчик изменения статуса заказа
+    """
+    # Проверка прав администратора
+    if not is_admin(callback_query.from_user.id):
+        await callback_query.answer("У вас нет прав для выполнения этой операции.")
+        return
+    
+    # Обновление статуса заказа
+    try:
+        success = update_order_status(order_id, new_status, actor_id=callback_query.from_user.id)
+    except InvalidStatusTransition as e:
+        # Кнопка из устаревшего сообщения: статус заказа уже изменился
+        await callback_query.answer(
+            f"Нельзя перевести заказ №{order_id} из статуса "
+            f"'{ORDER_STATUS_TITLES[e.old_status]}' в '{ORDER_STATUS_TITLES[e.new_status]}'",
+            show_alert=True
+        )
+        return
+    
+    if success:
+        await callback_query.answer(f"Статус заказа №{order_id} изменен на '{ORDER_STATUS_TITLES[new_status]}'")
+        
+        # Обновление сообщения с деталями заказа
+        order = get_order_details(order_id)
+        
+        if order:
+            await callback_query.message.edit_text(
+                render_order_details(order, status_changed=True),
+                reply_markup=order_status_keyboard(order_id, order.status),
+                parse_mode="HTML"
+            )
+    else:
+        await callback_query.answer("Не удалось обновить статус заказа.")
+
+@callback_table.register(FILTER_ORDERS, AdminStates.changing_order_status)
+async def back_to_orders_list(callback_query: CallbackQuery, state: FSMContext,
+                              status_filter: Optional[OrderStatus]) -> None:
+    """
+    Обработчик возврата к списку заказов из просмотра деталей
+    """
+    # Перенаправляем на обработчик фильтрации заказов
+    await state.set_state(AdminStates.viewing_orders)
+    await process_orders_filter(callback_query, state, status_filter)
+
+
+def create_dispatcher(update_tracker: Optional[UpdateTracker] = None) -> Dispatcher:
+    """
+    Создает диспетчер с хранилищем состояний, middleware и роутерами.
+    update_tracker нужен для плавной остановки бота
+    """
+    settings = get_settings()
+    
+    # Настройка хранилища состояний
+    storage = MemoryStorage()
+    dp = Dispatcher(storage=storage)
+    
+    # Учет обрабатываемых обновлений (самый внешний middleware)
+    if update_tracker is not None:
+        dp.update.outer_middleware(update_tracker)
+    
+    # Отбрасывание повторно доставленных обновлений до их обработки
+    deduplication = DeduplicationMiddleware(settings.dedup_cache_size)
+    dp.update.outer_middleware(deduplication)
+    
+    # Регистрация и обновление профилей всех, кто пишет боту
+    registration = UserRegistrationMiddleware(user_writer)
+    dp.message.outer_middleware(registration)
+    dp.callback_query.outer_middleware(registration)
+    
+    # Ограничение частоты запросов от одного пользователя
+    throttling = ThrottlingMiddleware(
+        settings.throttle_limits,
+        settings.throttle_default_limit,
+        settings.throttle_ttl
+    )
+    dp.message.outer_middleware(throttling)
+    dp.callback_query.outer_middleware(throttling)
+    
+    # Итоги защиты от повторов и ограничения частоты - в журнал при остановке
+    async def log_middleware_stats() -> None:
+        logger.info(f"Отброшено повторных обновлений: {deduplication.skipped}")
+        if throttling.rejected:
+            rejected = ', '.join(f"{key or 'прочие'} - {count}" for key, count in sorted(throttling.rejected.items()))
+            logger.info(f"Отброшено запросов сверх лимита: {rejected}")
+    dp.shutdown.register(log_middleware_stats)
+    
+    # Регистрация роутеров
+    dp.include_router(main_router)
+    dp.include_router(order_router)
+    dp.include_router(admin_router)
+    
+    return dp
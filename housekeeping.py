@@ -0,0 +1,68 @@
+"""
+Фоновые задачи обслуживания бота: очистка брошенных корзин, обновление
+кэша каталога, PRAGMA optimize, сжатие базы и резервное копирование.
+Задачи выполняются планировщиком вне обработки обновлений.
+"""
+import logging
+import time
+from typing import Optional
+
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from backup import backup_service
+from config import Settings
+from database import compact_database, optimize_database, refresh_product_cache
+from scheduler import Scheduler
+
+logger = logging.getLogger(__name__)
+
+def cleanup_abandoned_carts(storage: MemoryStorage, max_age: float, now: Optional[float] = None) -> int:
+    """
+    Сбрасывает состояние пользователей, чья корзина не менялась дольше
+    max_age секунд, и удаляет пустые записи хранилища (они появляются
+    при каждом чтении состояния). Возвращает число удаленных корзин
+    """
+    cutoff = (time.time() if now is None else now) - max_age
+    abandoned = 0
+    for key, record in list(storage.storage.items()):
+        updated_at = record.data.get('cart_updated_at')
+        if updated_at is not None and updated_at < cutoff:
+            abandoned += 1
+            del storage.storage[key]
+        elif record.state is None and not record.data:
+            del storage.storage[key]
+    return abandoned
+
+def register_jobs(scheduler: Scheduler, settings: Settings, storage: BaseStorage) -> None:
+    """
+    Добавляет задачи обслуживания согласно настройкам
+    """
+    scheduler.jitter = settings.job_jitter
+
+    if settings.cart_cleanup_interval > 0 and isinstance(storage, MemoryStorage):
+        async def cleanup_carts() -> None:
+            # Выполняется в цикле событий: хранилище состояний не потокобезопасно
+            removed = cleanup_abandoned_carts(storage, settings.cart_ttl)
+            if removed:
+                logger.info(f"Удалено брошенных корзин: {removed}")
+        scheduler.add_job('cart_cleanup', cleanup_carts, every=settings.cart_cleanup_interval)
+
+    if settings.cache_refresh_interval > 0 and settings.product_cache_ttl > 0:
+        async def refresh_cache() -> None:
+            # Кэш товаров меняется обработчиками в цикле событий; обновление
+            # из другого потока могло бы записать в кэш уже устаревшие остатки
+            refresh_product_cache()
+        scheduler.add_job('cache_refresh', refresh_cache, every=settings.cache_refresh_interval)
+
+    if settings.optimize_cron:
+        scheduler.add_job('optimize', optimize_database, cron=settings.optimize_cron)
+
+    if settings.compact_cron:
+        # VACUUM блокирует запись, поэтому во время работы только переносится
+        # журнал WAL; сжатие выполняется при запуске бота (см. main.py)
+        scheduler.add_job('compact', lambda: compact_database(settings.compact_min_free_ratio, vacuum=False),
+                          cron=settings.compact_cron)
+
+    if settings.backup_interval > 0:
+        scheduler.add_job('backup', backup_service.run_once, every=settings.backup_interval)
@@ -0,0 +1,145 @@
+"""
+Плавная остановка бота.
+
+По SIGTERM или SIGINT бот перестает получать обновления, дожидается уже
+начатых обработчиков (не дольше shutdown_timeout секунд), подтверждает
+Telegram обработанные обновления, останавливает фоновые задачи, записывает
+накопленные изменения, закрывает соединения с базой и сессию бота.
+Повторный сигнал прекращает ожидание обработчиков. Время каждого шага
+записывается в журнал.
+"""
+import asyncio
+import logging
+import signal
+import time
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator, List, Optional
+
+from aiogram import Bot, Dispatcher
+
+from backup import backup_service
+from database import close_database
+from middlewares import UpdateTracker
+from recorder import traffic_recorder
+from scheduler import scheduler
+from writers import stop_writers
+
+logger = logging.getLogger(__name__)
+
+class Lifecycle:
+    """
+    Запуск опроса Telegram и упорядоченная остановка бота
+    """
+    def __init__(self, bot: Bot, dp: Dispatcher, tracker: UpdateTracker, shutdown_timeout: float = 25.0):
+        self.bot = bot
+        self.dp = dp
+        self.tracker = tracker
+        self.shutdown_timeout = shutdown_timeout
+        self._stopping = False
+        self._force = asyncio.Event()
+        self._stop_polling: Optional[asyncio.Task] = None
+
+    def request_stop(self, sig: Optional[signal.Signals] = None) -> None:
+        """
+        Начинает остановку; повторный вызов прекращает ожидание обработчиков
+        """
+        name = sig.name if sig is not None else 'запрос'
+        if self._stopping:
+            logger.warning(f"Получен повторный сигнал {name}: незавершенные обработчики будут прерваны")
+            self._force.set()
+            return
+        logger.warning(f"Получен сигнал {name}, бот останавливается")
+        self._stopping = True
+        self.tracker.close()
+        self._stop_polling = asyncio.create_task(self._stop_dispatcher())
+
+    async def _stop_dispatcher(self) -> None:
+        try:
+            await self.dp.stop_polling()
+        except RuntimeError:
+            # Опрос еще не запущен; обновления все равно не принимаются
+            logger.warning("Опрос Telegram еще не запущен")
+
+    def install_signal_handlers(self) -> None:
+        """
+        Перехватывает SIGTERM и SIGINT (на Windows остается KeyboardInterrupt)
+        """
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            with suppress(NotImplementedError):
+                loop.add_signal_handler(sig, self.request_stop, sig)
+
+    @asynccontextmanager
+    async def _step(self, name: str) -> AsyncIterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            logger.exception(f"Остановка: ошибка на шаге '{name}'")
+        finally:
+            seconds = time.perf_counter() - started
+            logger.info(f"Остановка: {name} - {seconds * 1000:.0f} мс")
+
+    async def run_polling(self, **kwargs) -> None:
+        """
+        Получает обновления, пока не будет запрошена остановка, затем
+        останавливает бот. Сигналы и закрытие сессии обрабатываются здесь,
+        а не в aiogram: aiogram закрывает сессию, не дожидаясь обработчиков
+        """
+        self.install_signal_handlers()
+        try:
+            await self.dp.start_polling(self.bot, handle_signals=False, close_bot_session=False, **kwargs)
+        finally:
+            await self.shutdown()
+
+    async def _confirm_updates(self) -> None:
+        # Опрос подтверждает полученные обновления только следующим запросом
+        # getUpdates; без этого после перезапуска последние обработанные
+        # обновления пришли бы снова
+        offset = self.tracker.confirmed_offset()
+        if offset is not None:
+            await self.bot.get_updates(offset=offset, limit=1, timeout=0)
+
+    async def shutdown(self) -> None:
+        """
+        Останавливает бот по шагам. Ошибка одного шага не мешает остальным;
+        на ожидание обработчиков и фоновых задач вместе уходит не больше
+        shutdown_timeout
+        """
+        started = time.perf_counter()
+        deadline = time.monotonic() + self.shutdown_timeout
+        self._stopping = True
+        self.tracker.close()
+
+        in_flight = self.tracker.in_flight
+        aborted: List[int] = []
+        async with self._step(f"ожидание обработчиков ({in_flight})"):
+            aborted = await self.tracker.drain(self.shutdown_timeout, self._force)
+            if aborted:
+                # Telegram уже считает их доставленными: опрос подтверждает пачку
+                # обновлений сразу после того, как раздал их обработчикам
+                logger.warning(f"Не дождались обработки обновлений {aborted}, обработка прервана")
+
+        async with self._step("подтверждение обновлений"):
+            await self._confirm_updates()
+
+        async with self._step("фоновые задачи"):
+            # Расписание останавливается раньше, чем прерывается резервное копирование,
+            # поэтому новое копирование не начнется
+            await asyncio.gather(scheduler.stop(max(0.0, deadline - time.monotonic())), backup_service.stop())
+
+        async with self._step("запись накопленных изменений"):
+            await stop_writers()
+            await traffic_recorder.stop()
+
+        async with self._step("хранилище состояний"):
+            await self.dp.storage.close()
+
+        async with self._step("соединения с базой"):
+            close_database()
+
+        async with self._step("сессия бота"):
+            await self.bot.session.close()
+
+        logger.info(f"Бот остановлен за {(time.perf_counter() - started) * 1000:.0f} мс "
+                    f"(не принято обновлений: {self.tracker.rejected}, прервано: {len(aborted)})")
@@ -0,0 +1,250 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Callable, Awaitable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, CallbackQuery, Update, TelegramObject
+
+from callbacks import callback_name
+from writers import UserWriteBuffer
+
+logger = logging.getLogger(__name__)
+
+# Учет обрабатываемых обновлений для плавной остановки
+class UpdateTracker(BaseMiddleware):
+    """
+    Самый внешний middleware: запоминает обновления, которые сейчас
+    обрабатываются, и после close() перестает принимать новые.
+    Непринятые обновления не подтверждаются и будут получены снова
+    после перезапуска
+    """
+    def __init__(self):
+        self.accepting = True
+        self.last_update_id: Optional[int] = None
+        self.rejected = 0
+        self._in_flight: Dict[int, asyncio.Task] = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._in_flight)
+
+    def close(self) -> None:
+        """
+        Перестает принимать новые обновления
+        """
+        self.accepting = False
+
+    async def drain(self, timeout: float, force: Optional[asyncio.Event] = None) -> List[int]:
+        """
+        Ждет завершения начатых обработчиков не дольше timeout секунд
+        (или до установки force), оставшиеся отменяет. Возвращает
+        идентификаторы прерванных обновлений
+        """
+        waiters = [asyncio.ensure_future(self._idle.wait())]
+        if force is not None:
+            waiters.append(asyncio.ensure_future(force.wait()))
+        try:
+            await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+        aborted = sorted(self._in_flight)
+        tasks = list(self._in_flight.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return aborted
+
+    def confirmed_offset(self) -> Optional[int]:
+        """
+        Смещение getUpdates, подтверждающее все принятые обновления
+        """
+        return self.last_update_id + 1 if self.last_update_id is not None else None
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if not isinstance(event, Update):
+            return await handler(event, data)
+        if not self.accepting:
+            self.rejected += 1
+            logger.info(f"Бот останавливается, обновление {event.update_id} не принято")
+            return None
+
+        update_id = event.update_id
+        if self.last_update_id is None or update_id > self.last_update_id:
+            self.last_update_id = update_id
+        self._in_flight[update_id] = asyncio.current_task()
+        self._idle.clear()
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.pop(update_id, None)
+            if not self._in_flight:
+                self._idle.set()
+
+# Защита от повторной обработки обновлений
+class ProcessedUpdates:
+    """
+    Ограниченный LRU-набор идентификаторов уже обработанных обновлений
+    """
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._keys: OrderedDict = OrderedDict()
+
+    def check_and_add(self, key: Any) -> bool:
+        """
+        Запоминает ключ и возвращает True, если он уже встречался
+        """
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            return True
+        self._keys[key] = None
+        if len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+        return False
+
+class DeduplicationMiddleware(BaseMiddleware):
+    """
+    Внешний middleware, отбрасывающий повторно доставленные обновления
+    и повторные нажатия на одну и ту же inline-кнопку
+    """
+    def __init__(self, max_size: int = 10000):
+        self.processed = ProcessedUpdates(max_size)
+        self.skipped = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update):
+            if self.processed.check_and_add(('update', event.update_id)):
+                self.skipped += 1
+                logger.info(f"Пропущено повторное обновление {event.update_id}")
+                return None
+            if event.callback_query and self.processed.check_and_add(('callback', event.callback_query.id)):
+                self.skipped += 1
+                logger.info(f"Пропущен повторный callback {event.callback_query.id}")
+                return None
+        return await handler(event, data)
+
+class UserRegistrationMiddleware(BaseMiddleware):
+    """
+    Внешний middleware сообщений и callback-запросов: передает профиль
+    отправителя на отложенную запись. Неизмененные профили отсекаются
+    кэшем буфера, поэтому вызов дешев для каждого обновления
+    """
+    def __init__(self, writer: UserWriteBuffer):
+        self.writer = writer
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = getattr(event, 'from_user', None)
+        if user is not None:
+            self.writer.register(user.id, user.username, user.full_name)
+        return await handler(event, data)
+
+# Ограничение частоты запросов
+class TokenBucket:
+    """
+    Корзина токенов для одного пользователя и одного лимита
+    """
+    __slots__ = ('tokens', 'updated_at')
+
+    def __init__(self, tokens: float, updated_at: float):
+        self.tokens = tokens
+        self.updated_at = updated_at
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware, ограничивающий частоту запросов каждого пользователя.
+    Лишние обновления отбрасываются до обращения к базе данных
+    """
+    def __init__(self, limits: Dict[str, Tuple[float, int]],
+                 default_limit: Tuple[float, int], ttl: float = 600.0):
+        self.limits = limits
+        self.default_limit = default_limit
+        self.ttl = ttl
+        self.buckets: Dict[Tuple[int, str], TokenBucket] = {}
+        self.rejected: Dict[str, int] = {}
+        self._next_cleanup = time.monotonic() + ttl
+
+    @staticmethod
+    def get_throttle_key(event: TelegramObject) -> Optional[str]:
+        """
+        Определяет ключ лимита: имя команды или префикс данных callback
+        """
+        if isinstance(event, Message):
+            text = event.text or ''
+            if text.startswith('/'):
+                command = text[1:].split(maxsplit=1)
+                return command[0].split('@', 1)[0] if command else ''
+            return ''
+        if isinstance(event, CallbackQuery):
+            return callback_name(event.data or '')
+        return None
+
+    def allow(self, user_id: int, key: str) -> bool:
+        """
+        Списывает токен из корзины пользователя, если он доступен
+        """
+        now = time.monotonic()
+        if now >= self._next_cleanup:
+            self.cleanup(now)
+
+        if key not in self.limits:
+            key = ''
+        rate, burst = self.limits.get(key, self.default_limit)
+        bucket_key = (user_id, key)
+        bucket = self.buckets.get(bucket_key)
+        if bucket is None:
+            self.buckets[bucket_key] = TokenBucket(burst - 1, now)
+            return True
+
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated_at) * rate)
+        bucket.updated_at = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+
+        self.rejected[key] = self.rejected.get(key, 0) + 1
+        return False
+
+    def cleanup(self, now: float) -> None:
+        """
+        Удаляет корзины пользователей, неактивных дольше TTL
+        """
+        expired = [k for k, b in self.buckets.items() if now - b.updated_at > self.ttl]
+        for k in expired:
+            del self.buckets[k]
+        self._next_cleanup = now + self.ttl
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = getattr(event, 'from_user', None)
+        key = self.get_throttle_key(event)
+        if user is None or key is None or self.allow(user.id, key):
+            return await handler(event, data)
+
+        logger.debug(f"Отброшен запрос '{key}' пользователя {user.id}")
+        if isinstance(event, CallbackQuery):
+            await event.answer("Слишком много запросов, попробуйте позже.")
+        return None
@@ -0,0 +1,222 @@
+"""
+Модели данных магазина.
+
+Классы используют __slots__, чтобы экземпляры занимали меньше памяти,
+чем словари, и создаются напрямую из строк SQLite через row factory.
+"""
+import sqlite3
+from array import array
+from enum import IntEnum
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+class OrderStatus(IntEnum):
+    """
+    Статус заказа. В базе хранится числовой код
+    """
+    NEW = 0
+    PROCESSING = 1
+    SHIPPED = 2
+    DELIVERED = 3
+    CANCELLED = 4
+
+# Жизненный цикл заказа: из какого статуса в какие можно перейти.
+# Доставленный и отмененный заказы больше не меняются
+ORDER_TRANSITIONS: Dict[OrderStatus, Tuple[OrderStatus, ...]] = {
+    OrderStatus.NEW: (OrderStatus.PROCESSING, OrderStatus.CANCELLED),
+    OrderStatus.PROCESSING: (OrderStatus.SHIPPED, OrderStatus.CANCELLED),
+    OrderStatus.SHIPPED: (OrderStatus.DELIVERED,),
+    OrderStatus.DELIVERED: (),
+    OrderStatus.CANCELLED: (),
+}
+
+def can_change_status(old_status: int, new_status: int) -> bool:
+    """
+    Проверяет, допустим ли переход заказа между статусами
+    """
+    return new_status in ORDER_TRANSITIONS.get(old_status, ())
+
+class Product:
+    """
+    Товар каталога
+    """
+    __slots__ = ('id', 'name', 'description', 'price', 'stock')
+
+    def __init__(self, id: int, name: str, description: Optional[str], price: float, stock: int):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.price = price
+        self.stock = stock
+
+    def __repr__(self) -> str:
+        return f"Product(id={self.id}, name={self.name!r}, price={self.price}, stock={self.stock})"
+
+class Warehouse:
+    """
+    Склад. Чем меньше priority, тем ближе склад к покупателям
+    """
+    __slots__ = ('id', 'name', 'priority')
+
+    def __init__(self, id: int, name: str, priority: int):
+        self.id = id
+        self.name = name
+        self.priority = priority
+
+class WarehouseStock:
+    """
+    Остаток товара на одном складе
+    """
+    __slots__ = ('warehouse_id', 'name', 'qty')
+
+    def __init__(self, warehouse_id: int, name: str, qty: int):
+        self.warehouse_id = warehouse_id
+        self.name = name
+        self.qty = qty
+
+class OrderItem:
+    """
+    Позиция заказа с ценой на момент оформления
+    """
+    __slots__ = ('name', 'quantity', 'price')
+
+    def __init__(self, name: str, quantity: int, price: float):
+        self.name = name
+        self.quantity = quantity
+        self.price = price
+
+    @property
+    def total(self) -> float:
+        return self.price * self.quantity
+
+class Order:
+    """
+    Заказ. Данные покупателя и позиции заполняются только
+    при получении деталей заказа
+    """
+    __slots__ = ('id', 'user_id', 'order_date', 'status', 'total_price',
+                 'username', 'full_name', 'items')
+
+    def __init__(self, id: int, user_id: int, order_date: str, status: int, total_price: float):
+        self.id = id
+        self.user_id = user_id
+        self.order_date = order_date
+        self.status = status
+        self.total_price = total_price
+        self.username: Optional[str] = None
+        self.full_name: Optional[str] = None
+        self.items: Tuple[OrderItem, ...] = ()
+
+    @property
+    def total_items(self) -> int:
+        return sum(item.quantity for item in self.items)
+
+class OrderSummary:
+    """
+    Строка списка заказов для администратора
+    """
+    __slots__ = ('id', 'customer_name', 'order_date', 'status', 'total_price', 'items_count')
+
+    def __init__(self, id: int, customer_name: Optional[str], order_date: str,
+                 status: int, total_price: float, items_count: int):
+        self.id = id
+        self.customer_name = customer_name
+        self.order_date = order_date
+        self.status = status
+        self.total_price = total_price
+        self.items_count = items_count
+
+class AuditEntry:
+    """
+    Запись журнала изменений остатка товара или статуса заказа.
+    warehouse_name задан для изменения остатка на одном складе
+    """
+    __slots__ = ('created_at', 'field', 'old_value', 'new_value', 'actor_id', 'actor_name', 'warehouse_name')
+
+    def __init__(self, created_at: str, field: str, old_value: Any, new_value: Any,
+                 actor_id: Optional[int], actor_name: Optional[str], warehouse_name: Optional[str] = None):
+        self.created_at = created_at
+        self.field = field
+        self.old_value = old_value
+        self.new_value = new_value
+        self.actor_id = actor_id
+        self.actor_name = actor_name
+        self.warehouse_name = warehouse_name
+
+class Cart:
+    """
+    Корзина покупателя: пары (ID товара, количество) в одном массиве
+    и ключ идемпотентности для оформления заказа.
+    В состоянии FSM хранится как короткая строка, см. dumps/loads
+    """
+    __slots__ = ('key', '_items')
+
+    def __init__(self, key: str, items: Optional[array] = None):
+        self.key = key
+        self._items = items if items is not None else array('q')
+
+    def add(self, product_id: int, quantity: int) -> None:
+        """
+        Добавляет товар или увеличивает его количество
+        """
+        items = self._items
+        for i in range(0, len(items), 2):
+            if items[i] == product_id:
+                items[i + 1] += quantity
+                return
+        items.append(product_id)
+        items.append(quantity)
+
+    def items(self) -> Iterator[Tuple[int, int]]:
+        """
+        Пары (ID товара, количество) в порядке добавления
+        """
+        items = self._items
+        return zip(items[0::2], items[1::2])
+
+    def __len__(self) -> int:
+        return len(self._items) // 2
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+    def dumps(self) -> str:
+        """
+        Сериализует корзину в строку вида 'ключ;1:2,5:1'
+        """
+        return self.key + ';' + ','.join(f'{pid}:{qty}' for pid, qty in self.items())
+
+    @classmethod
+    def loads(cls, value: str) -> 'Cart':
+        """
+        Восстанавливает корзину из строки, созданной dumps
+        """
+        key, _, packed = value.partition(';')
+        items = array('q')
+        if packed:
+            for pair in packed.split(','):
+                pid, _, qty = pair.partition(':')
+                items.append(int(pid))
+                items.append(int(qty))
+        return cls(key, items)
+
+# Фабрики строк для sqlite3: объекты создаются прямо при чтении курсора
+def product_row(cursor: sqlite3.Cursor, row: tuple) -> Product:
+    return Product(*row)
+
+def warehouse_row(cursor: sqlite3.Cursor, row: tuple) -> Warehouse:
+    return Warehouse(*row)
+
+def warehouse_stock_row(cursor: sqlite3.Cursor, row: tuple) -> WarehouseStock:
+    return WarehouseStock(*row)
+
+def order_row(cursor: sqlite3.Cursor, row: tuple) -> Order:
+    return Order(*row)
+
+def order_item_row(cursor: sqlite3.Cursor, row: tuple) -> OrderItem:
+    return OrderItem(*row)
+
+def order_summary_row(cursor: sqlite3.Cursor, row: tuple) -> OrderSummary:
+    return OrderSummary(*row)
+
+def audit_entry_row(cursor: sqlite3.Cursor, row: tuple) -> AuditEntry:
+    return AuditEntry(*row)
@@ -0,0 +1,195 @@
+"""
+Запись входящих обновлений для воспроизведения (bench.py replay).
+
+Каждое принятое обновление записывается строкой JSON в сжатый файл
+record_dir/updates-<время запуска>.ndjson.gz вместе со временем от начала
+записи. Сохраняются только поля из списка разрешенных: идентификаторы
+пользователей, чатов и сообщений, даты, данные кнопок и разметка текста -
+они нужны, чтобы воспроизведение на снимке базы шло по тем же веткам
+обработчиков. Имена и username заменяются псевдонимами (одинаковыми для
+одного значения в пределах файла), текст - звездочками той же длины.
+Команды сохраняются всегда, числа - только в состояниях, где бот ждет
+число (номер заказа, остаток). Остальные поля (контакты, адреса,
+геопозиция, пересылка, вложения) не записываются.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, IO, Iterator, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import Settings
+from writers import BatchWriter
+
+logger = logging.getLogger(__name__)
+
+RECORD_PREFIX = 'updates-'
+RECORD_SUFFIX = '.ndjson.gz'
+
+# Поля, которые записываются как есть; поля не из этих списков отбрасываются
+_KEEP_FIELDS = frozenset({
+    'update_id', 'message', 'edited_message', 'callback_query', 'reply_to_message',
+    'message_id', 'message_thread_id', 'is_topic_message', 'date', 'edit_date',
+    'id', 'is_bot', 'type', 'chat', 'from', 'chat_instance', 'inline_message_id', 'data',
+    'entities', 'caption_entities', 'offset', 'length',
+})
+# Имена пользователей и чатов, значения заменяются псевдонимами
+_NAME_FIELDS = frozenset({'first_name', 'last_name', 'username', 'title'})
+# Текст пользователя и сообщений бота
+_TEXT_FIELDS = frozenset({'text', 'caption'})
+
+_NUMBER = re.compile(r'-?\d+')
+_NOT_SPACE = re.compile(r'\S')
+
+class Scrubber:
+    """
+    Удаление личных данных из обновления. Псевдонимы строятся по ключу,
+    который не сохраняется, поэтому исходные значения не восстановить
+    """
+    def __init__(self, key: Optional[bytes] = None):
+        self.key = key if key is not None else os.urandom(16)
+
+    def _pseudonym(self, field: str, value: str) -> str:
+        digest = hashlib.blake2b(value.encode(), key=self.key, digest_size=4).hexdigest()
+        return f"{field}_{digest}"
+
+    @staticmethod
+    def _text(value: str, keep_numbers: bool) -> str:
+        # Команды управляют ветками обработчиков; число сохраняется, только
+        # когда бот его ждет - иначе это может быть телефон или номер карты
+        if value.startswith('/') or (keep_numbers and _NUMBER.fullmatch(value.strip())):
+            return value
+        return _NOT_SPACE.sub('*', value)
+
+    def scrub(self, value: Any, keep_numbers: bool = False) -> Any:
+        """
+        Копия данных обновления только с разрешенными полями.
+        keep_numbers - сохранять текст, состоящий из одного числа
+        """
+        if isinstance(value, dict):
+            result = {}
+            for field, item in value.items():
+                if field in _NAME_FIELDS and isinstance(item, str):
+                    result[field] = self._pseudonym(field, item)
+                elif field in _TEXT_FIELDS and isinstance(item, str):
+                    result[field] = self._text(item, keep_numbers)
+                elif field in _KEEP_FIELDS:
+                    result[field] = self.scrub(item, keep_numbers)
+            return result
+        if isinstance(value, list):
+            return [self.scrub(item, keep_numbers) for item in value]
+        return value
+
+class TrafficRecorder(BatchWriter):
+    """
+    Запись обновлений в файл. Обработчики только добавляют обновление
+    в очередь; преобразование в JSON, удаление личных данных и сжатие
+    выполняются в отдельном потоке при записи пачки
+    """
+    name = 'traffic'
+
+    def __init__(self, record_dir: str = 'recordings', flush_interval: float = 5.0, batch_size: int = 500):
+        super().__init__(flush_interval, batch_size)
+        self.record_dir = record_dir
+        self.path: Optional[str] = None
+        self.recorded = 0
+        self._pending: List[Tuple[float, Update, bool]] = []
+        self._started_at: Optional[float] = None
+        self._file: Optional[IO[str]] = None
+        self._scrubber = Scrubber()
+
+    def record(self, update: Update, keep_numbers: bool = False) -> None:
+        """
+        Добавляет обновление в очередь на запись. keep_numbers - бот
+        ждет от пользователя число, его нужно сохранить для воспроизведения
+        """
+        now = time.monotonic()
+        if self._started_at is None:
+            self._started_at = now
+        self._pending.append((now - self._started_at, update, keep_numbers))
+        self._notify()
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _take_batch(self) -> List[Tuple[float, Update, bool]]:
+        pending, self._pending = self._pending, []
+        return pending
+
+    def _write(self, batch: List[Tuple[float, Update, bool]]) -> None:
+        if self._file is None:
+            os.makedirs(self.record_dir, exist_ok=True)
+            name = f"{RECORD_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}{RECORD_SUFFIX}"
+            self.path = os.path.join(self.record_dir, name)
+            self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+            logger.info(f"Обновления записываются в {self.path}")
+
+        for at, update, keep_numbers in batch:
+            data = self._scrubber.scrub(update.model_dump(mode='json', exclude_none=True, by_alias=True),
+                                        keep_numbers)
+            self._file.write(json.dumps({'at': round(at, 3), 'update': data}, ensure_ascii=False,
+                                        separators=(',', ':')))
+            self._file.write('\n')
+        # Записанное должно читаться, даже если бот завершится аварийно
+        self._file.flush()
+        self.recorded += len(batch)
+
+    def _restore(self, batch: List[Tuple[float, Update, bool]]) -> None:
+        self._pending[:0] = batch
+
+    def _close(self) -> None:
+        # Вызывается под блокировкой записи: файл не закрывается посреди пачки
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            logger.info(f"Записано обновлений: {self.recorded} ({self.path})")
+
+class RecorderMiddleware(BaseMiddleware):
+    """
+    Внешний middleware, передающий принятые обновления на запись.
+    Выполняется после middleware состояний aiogram, поэтому знает
+    состояние пользователя; numeric_states - состояния, в которых
+    бот ждет число
+    """
+    def __init__(self, recorder: TrafficRecorder, numeric_states: FrozenSet[str] = frozenset()):
+        self.recorder = recorder
+        self.numeric_states = numeric_states
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update):
+            self.recorder.record(event, data.get('raw_state') in self.numeric_states)
+        return await handler(event, data)
+
+def read_recording(path: str) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    """
+    Читает записанные обновления: (секунд от начала записи, данные обновления).
+    Файл, не закрытый из-за аварийного завершения бота, читается до обрыва
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        try:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record['at'], record['update']
+        except (EOFError, json.JSONDecodeError):
+            logger.warning(f"Запись {path} оборвана, прочитано до места обрыва")
+
+traffic_recorder = TrafficRecorder()
+
+def configure_recorder(settings: Settings) -> None:
+    """
+    Применяет настройки записи обновлений
+    """
+    traffic_recorder.record_dir = settings.record_dir
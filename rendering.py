@@ -0,0 +1,351 @@
+"""
+Шаблоны сообщений и клавиатуры бота.
+
+Шаблоны собираются один раз при импорте модуля, статические клавиатуры
+создаются один раз и переиспользуются - их нельзя изменять после создания.
+"""
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from callbacks import ADD_TO_CART, CART, FILTER_ORDERS, ORDER_STATUS, QUANTITY, UPDATE_STOCK, WAREHOUSE_STOCK
+from models import ORDER_TRANSITIONS, AuditEntry, Order, OrderStatus, OrderSummary, Product, WarehouseStock
+from scheduler import Job
+
+# Названия статусов заказа по их кодам
+ORDER_STATUS_TITLES = ('Новый', 'В обработке', 'Отправлен', 'Доставлен', 'Отменен')
+
+# Шаблоны сообщений
+_CATALOG_HEADER = "📋 Каталог товаров:\n\n"
+_CATALOG_ITEM = "🔹 <b>{name}</b> - {price:.2f} грн.\n{description}\nСтатус: {status}\n\n".format
+_IN_STOCK = "✅ В наличии"
+_OUT_OF_STOCK = "❌ Нет в наличии"
+
+_PRODUCT_BUTTON = "{name} - {price:.2f} грн. (В наличии: {stock})".format
+
+_CART_ITEM = "{name} x {quantity} = {total:.2f} грн.".format
+_CART = (
+    "Товар добавлен в корзину! 🛒\n\n"
+    "Содержимое корзины:\n"
+    "{items}\n\n"
+    "Итого: {total:.2f} грн."
+).format
+
+_STOCK_HEADER = "📊 Текущие запасы товаров:\n\n"
+_STOCK_ITEM = "ID: {id} | {name} - {stock} шт. | {price:.2f} грн.\n".format
+_STOCK_WAREHOUSE = "{name}: {qty}".format
+_WAREHOUSE_BUTTON = "{name} ({qty} шт.)".format
+_STOCK_FOOTER = "\nДля обновления запасов выберите товар:"
+
+_ORDERS_HEADER = "📋 Список заказов (фильтр: {filter}):\n\n".format
+_ORDERS_ITEM = (
+    "🔸 <b>Заказ №{id}</b>\n"
+    "Клиент: {customer}\n"
+    "Дата: {date}\n"
+    "Статус: {status}\n"
+    "Сумма: {total:.2f} грн.\n"
+    "Позиций: {items_count}\n\n"
+).format
+_ORDERS_FOOTER = "Для просмотра деталей и управления заказом, введите номер заказа:"
+
+_ORDER_ITEM = "- {name} x {quantity} = {total:.2f} грн.\n".format
+_ORDER_SUMMARY = (
+    "📦 Заказ №{id}\n"
+    "Дата: {date}\n"
+    "Статус: {status}\n\n"
+    "Товары:\n"
+    "{items}"
+    "\nИтого: {total:.2f} грн."
+).format
+
+_ORDER_DETAILS_ITEM = "• {name} x {quantity} = {total:.2f} грн.\n".format
+_ORDER_DETAILS = (
+    "📦 <b>Детали заказа №{id}</b>\n\n"
+    "👤 <b>Клиент:</b> {customer}{username}\n"
+    "<b>ID пользователя:</b> {user_id}\n\n"
+    "<b>Дата заказа:</b> {date}\n"
+    "<b>Статус:</b> {status}{status_mark}\n\n"
+    "<b>Товары в заказе:</b>\n"
+    "{items}"
+    "\n<b>Всего товаров:</b> {total_items} шт."
+    "\n<b>Итого:</b> {total:.2f} грн."
+).format
+
+_HISTORY_HEADER = "📜 История изменений {title}:\n\n".format
+_HISTORY_ITEM = "{date} | {field}: {old} → {new} | {actor}\n".format
+_HISTORY_FIELDS = {'stock': 'Остаток', 'warehouse_stock': 'Остаток на складе', 'status': 'Статус'}
+_HISTORY_EMPTY = "Изменений пока нет."
+
+# Статические клавиатуры
+CART_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="Добавить еще", callback_data=CART.pack("add_more")),
+            InlineKeyboardButton(text="Оформить заказ", callback_data=CART.pack("checkout"))
+        ],
+        [
+            InlineKeyboardButton(text="Очистить корзину", callback_data=CART.pack("clear"))
+        ]
+    ]
+)
+
+ORDERS_FILTER_KEYBOARD = InlineKeyboardMarkup(
+    inline_keyboard=[
+        [
+            InlineKeyboardButton(text="Все заказы", callback_data=FILTER_ORDERS.pack(None)),
+            InlineKeyboardButton(text="Новые", callback_data=FILTER_ORDERS.pack(OrderStatus.NEW))
+        ],
+        [
+            InlineKeyboardButton(text="В обработке", callback_data=FILTER_ORDERS.pack(OrderStatus.PROCESSING)),
+            InlineKeyboardButton(text="Отправлен", callback_data=FILTER_ORDERS.pack(OrderStatus.SHIPPED))
+        ],
+        [
+            InlineKeyboardButton(text="Доставлен", callback_data=FILTER_ORDERS.pack(OrderStatus.DELIVERED)),
+            InlineKeyboardButton(text="Отменен", callback_data=FILTER_ORDERS.pack(OrderStatus.CANCELLED))
+        ]
+    ]
+)
+
+_BACK_TO_ORDERS_ROW = [InlineKeyboardButton(text="« Назад к списку", callback_data=FILTER_ORDERS.pack(None))]
+
+@lru_cache(maxsize=256)
+def order_status_keyboard(order_id: int, status: int) -> InlineKeyboardMarkup:
+    """
+    Клавиатура управления статусом заказа: только допустимые
+    из текущего статуса переходы (кэшируется по ID заказа и статусу)
+    """
+    buttons = [
+        InlineKeyboardButton(
+            text=ORDER_STATUS_TITLES[next_status],
+            callback_data=ORDER_STATUS.pack(order_id, next_status)
+        )
+        for next_status in ORDER_TRANSITIONS[OrderStatus(status)]
+    ]
+    rows = [buttons] if buttons else []
+    return InlineKeyboardMarkup(inline_keyboard=rows + [_BACK_TO_ORDERS_ROW])
+
+@lru_cache(maxsize=None)
+def quantity_keyboard(max_quantity: int) -> InlineKeyboardMarkup:
+    """
+    Клавиатура выбора количества: ряды по 5 кнопок от 1 до max_quantity
+    """
+    buttons = []
+    for i in range(1, max_quantity + 1, 5):
+        buttons.append([
+            InlineKeyboardButton(text=str(j), callback_data=QUANTITY.pack(j))
+            for j in range(i, min(i + 5, max_quantity + 1))
+        ])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+def _cached_for_products(build: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Запоминает результат для последнего переданного списка товаров.
+    Кэш товаров возвращает один и тот же список, пока каталог не изменился,
+    поэтому достаточно сравнения по идентичности. Остальные аргументы
+    должны кэшироваться вместе со списком товаров
+    """
+    last: List[Any] = [None, None]
+
+    def wrapper(products: Sequence[Product], *args: Any) -> Any:
+        if last[0] is not products:
+            last[1] = build(products, *args)
+            last[0] = products
+        return last[1]
+
+    wrapper.__doc__ = build.__doc__
+    return wrapper
+
+# Каталог и остатки
+@_cached_for_products
+def render_catalog(products: Sequence[Product]) -> str:
+    """
+    Текст каталога товаров
+    """
+    return _CATALOG_HEADER + ''.join(
+        _CATALOG_ITEM(
+            name=p.name, price=p.price, description=p.description,
+            status=_IN_STOCK if p.stock > 0 else _OUT_OF_STOCK
+        )
+        for p in products
+    )
+
+@_cached_for_products
+def products_keyboard(products: Sequence[Product]) -> Optional[InlineKeyboardMarkup]:
+    """
+    Клавиатура выбора товаров, которые есть в наличии
+    """
+    rows = [
+        [InlineKeyboardButton(
+            text=_PRODUCT_BUTTON(name=p.name, price=p.price, stock=p.stock),
+            callback_data=ADD_TO_CART.pack(p.id)
+        )]
+        for p in products if p.stock > 0
+    ]
+    return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+@_cached_for_products
+def render_stock(products: Sequence[Product],
+                 breakdown: Dict[int, Tuple[WarehouseStock, ...]]) -> Tuple[str, InlineKeyboardMarkup]:
+    """
+    Текст текущих остатков и клавиатура выбора товара для их обновления.
+    Если складов несколько, под каждым товаром выводятся остатки по складам
+    """
+    warehouse_ids = {s.warehouse_id for stock in breakdown.values() for s in stock}
+    lines = []
+    for p in products:
+        lines.append(_STOCK_ITEM(id=p.id, name=p.name, stock=p.stock, price=p.price))
+        if len(warehouse_ids) > 1 and p.id in breakdown:
+            lines.append('    ' + ' | '.join(
+                _STOCK_WAREHOUSE(name=s.name, qty=s.qty) for s in breakdown[p.id]
+            ) + '\n')
+    text = _STOCK_HEADER + ''.join(lines) + _STOCK_FOOTER
+    markup = InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(
+                text=f"Обновить запас: {p.name}",
+                callback_data=UPDATE_STOCK.pack(p.id)
+            )] for p in products
+        ]
+    )
+    return text, markup
+
+def warehouses_keyboard(product_id: int, stock: Sequence[WarehouseStock]) -> InlineKeyboardMarkup:
+    """
+    Клавиатура выбора склада для обновления остатка товара
+    """
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [InlineKeyboardButton(
+                text=_WAREHOUSE_BUTTON(name=s.name, qty=s.qty),
+                callback_data=WAREHOUSE_STOCK.pack(product_id, s.warehouse_id)
+            )] for s in stock
+        ]
+    )
+
+# Корзина
+def render_cart(cart_lines: Sequence[Tuple[str, int, float]], cart_total: float) -> str:
+    """
+    Содержимое корзины: строки (название, количество, сумма) и итог
+    """
+    items = '\n'.join(
+        _CART_ITEM(name=name, quantity=quantity, total=total)
+        for name, quantity, total in cart_lines
+    )
+    return _CART(items=items, total=cart_total)
+
+# Заказы
+def render_orders_list(orders: Sequence[OrderSummary], status_filter: Optional[int]) -> str:
+    """
+    Список заказов для администратора
+    """
+    filter_title = 'all' if status_filter is None else ORDER_STATUS_TITLES[status_filter]
+    return _ORDERS_HEADER(filter=filter_title) + ''.join(
+        _ORDERS_ITEM(
+            id=o.id, customer=o.customer_name, date=o.order_date,
+            status=ORDER_STATUS_TITLES[o.status], total=o.total_price, items_count=o.items_count
+        )
+        for o in orders
+    ) + _ORDERS_FOOTER
+
+def render_order_summary(order: Order) -> str:
+    """
+    Краткая информация о заказе для покупателя
+    """
+    items = ''.join(
+        _ORDER_ITEM(name=item.name, quantity=item.quantity, total=item.total)
+        for item in order.items
+    )
+    return _ORDER_SUMMARY(
+        id=order.id, date=order.order_date, status=ORDER_STATUS_TITLES[order.status],
+        items=items, total=order.total_price
+    )
+
+def render_order_details(order: Order, status_changed: bool = False) -> str:
+    """
+    Детали заказа для администратора. После смены статуса
+    рядом со статусом выводится отметка
+    """
+    return _ORDER_DETAILS(
+        id=order.id,
+        customer=order.full_name,
+        username=f" (@{order.username})" if order.username else "",
+        user_id=order.user_id,
+        date=order.order_date,
+        status=ORDER_STATUS_TITLES[order.status],
+        status_mark=" ✅" if status_changed else "",
+        items=''.join(
+            _ORDER_DETAILS_ITEM(name=item.name, quantity=item.quantity, total=item.total)
+            for item in order.items
+        ),
+        total_items=order.total_items,
+        total=order.total_price
+    )
+
+# Журнал изменений
+def _history_value(field: str, value: Any) -> Any:
+    """
+    Значение из журнала в виде для показа: статусы хранятся кодами
+    """
+    if value is None:
+        return "—"
+    if field == 'status':
+        return ORDER_STATUS_TITLES[value]
+    return value
+
+def _history_field(entry: AuditEntry) -> str:
+    """
+    Название измененного поля, для остатка на складе - с названием склада
+    """
+    title = _HISTORY_FIELDS.get(entry.field, entry.field)
+    if entry.warehouse_name is not None:
+        return f"{title} «{entry.warehouse_name}»"
+    return title
+
+def render_history(title: str, entries: Sequence[AuditEntry]) -> str:
+    """
+    История изменений товара или заказа, от новых записей к старым
+    """
+    if not entries:
+        return _HISTORY_HEADER(title=title) + _HISTORY_EMPTY
+    return _HISTORY_HEADER(title=title) + ''.join(
+        _HISTORY_ITEM(
+            date=e.created_at,
+            field=_history_field(e),
+            old=_history_value(e.field, e.old_value),
+            new=_history_value(e.field, e.new_value),
+            actor=e.actor_name or (f"ID {e.actor_id}" if e.actor_id else "система")
+        )
+        for e in entries
+    )
+
+# Фоновые задачи
+_JOBS_HEADER = "⏱ Фоновые задачи:\n\n"
+_JOBS_EMPTY = "Фоновые задачи не запланированы"
+_JOB_ITEM = (
+    "<b>{name}</b> ({schedule}), следующий запуск: {next_run}{running}\n"
+    "запусков {runs}, ошибок {failures}, пропущено {skipped}\n"
+    "время: последнее {last:.1f} мс, среднее {average:.1f} мс, макс. {max:.1f} мс\n\n"
+).format
+
+def render_jobs(jobs: Sequence[Job]) -> str:
+    """
+    Расписание и статистика фоновых задач
+    """
+    if not jobs:
+        return _JOBS_EMPTY
+    return _JOBS_HEADER + ''.join(
+        _JOB_ITEM(
+            name=job.name,
+            schedule=job.cron.expression if job.cron is not None else f"каждые {job.every:g} с",
+            next_run=f"{job.next_run_at:%d.%m %H:%M:%S}" if job.next_run_at else "—",
+            running=" (выполняется)" if job.running else "",
+            runs=job.stats.runs,
+            failures=job.stats.failures,
+            skipped=job.stats.skipped,
+            last=job.stats.last_seconds * 1000,
+            average=job.stats.average_seconds * 1000,
+            max=job.stats.max_seconds * 1000
+        )
+        for job in jobs
+    )
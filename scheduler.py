@@ -0,0 +1,287 @@
+"""
+Планировщик фоновых задач в цикле событий бота.
+
+Задача запускается с интервалом (every) или по расписанию в формате
+cron (минута, час, день месяца, месяц, день недели). К каждому запуску
+добавляется случайная задержка до jitter секунд, чтобы задачи с
+одинаковым расписанием не шли одновременно. Если предыдущий запуск
+задачи еще не закончился, очередной пропускается.
+"""
+import asyncio
+import inspect
+import logging
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, FrozenSet, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Поля расписания cron: (наименьшее, наибольшее значение)
+_CRON_FIELDS = (('минута', 0, 59), ('час', 0, 23), ('день', 1, 31), ('месяц', 1, 12), ('день недели', 0, 7))
+
+def _parse_cron_field(text: str, name: str, low: int, high: int) -> FrozenSet[int]:
+    values = set()
+    for part in text.split(','):
+        body, _, step_text = part.partition('/')
+        try:
+            step = int(step_text) if step_text else 1
+            if body == '*':
+                start, end = low, high
+            elif '-' in body:
+                start, end = (int(v) for v in body.split('-', 1))
+            else:
+                start = int(body)
+                end = high if step_text else start
+        except ValueError:
+            raise ValueError(f"Некорректное поле '{name}' в расписании: '{text}'") from None
+        if step < 1 or start < low or end > high or start > end:
+            raise ValueError(f"Поле '{name}' вне диапазона {low}-{high}: '{text}'")
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+class CronTrigger:
+    """
+    Расписание в формате cron: '30 4 * * *' - каждый день в 4:30.
+    Поддерживаются *, списки, диапазоны и шаг (*/15, 1-5). Воскресенье - 0 или 7
+    """
+    __slots__ = ('expression', 'minutes', 'hours', 'days', 'months', 'weekdays', '_any_day', '_any_weekday')
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != len(_CRON_FIELDS):
+            raise ValueError(f"В расписании cron должно быть {len(_CRON_FIELDS)} полей: '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_cron_field(part, *spec) for part, spec in zip(parts, _CRON_FIELDS)
+        )
+        self.weekdays = frozenset(day % 7 for day in weekdays)
+        self._any_day = parts[2] == '*'
+        self._any_weekday = parts[4] == '*'
+
+    def _day_matches(self, moment: datetime) -> bool:
+        # Как в cron: если заданы и день месяца, и день недели, достаточно совпадения одного
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        if self._any_day or self._any_weekday:
+            return day and weekday
+        return day or weekday
+
+    def next_after(self, moment: datetime) -> datetime:
+        """
+        Ближайшее время запуска строго после moment
+        """
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Расписание вроде '0 0 31 2 *' не сработает никогда; ищем не дальше 5 лет
+        limit = moment + timedelta(days=5 * 366)
+        while moment < limit:
+            if moment.month not in self.months:
+                month = moment.month % 12 + 1
+                moment = moment.replace(year=moment.year + (month == 1), month=month, day=1, hour=0, minute=0)
+            elif not self._day_matches(moment):
+                moment = moment.replace(hour=0, minute=0) + timedelta(days=1)
+            elif moment.hour not in self.hours:
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"Расписание '{self.expression}' никогда не срабатывает")
+
+    def __str__(self) -> str:
+        return f"cron '{self.expression}'"
+
+def parse_cron(expression: str) -> CronTrigger:
+    """
+    Разбирает расписание cron, вызывает ValueError при ошибке
+    """
+    trigger = CronTrigger(expression)
+    trigger.next_after(datetime.now())
+    return trigger
+
+class JobStats:
+    """
+    Счетчики и время выполнения задачи
+    """
+    __slots__ = ('runs', 'failures', 'skipped', 'total_seconds', 'last_seconds', 'max_seconds',
+                 'last_started_at', 'last_error')
+
+    def __init__(self):
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.total_seconds = 0.0
+        self.last_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_started_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def average_seconds(self) -> float:
+        return self.total_seconds / self.runs if self.runs else 0.0
+
+    def __str__(self) -> str:
+        return (f"запусков {self.runs}, ошибок {self.failures}, пропущено {self.skipped}, "
+                f"последний {self.last_seconds * 1000:.1f} мс, средний {self.average_seconds * 1000:.1f} мс, "
+                f"максимальный {self.max_seconds * 1000:.1f} мс")
+
+JobFunc = Callable[[], Union[Awaitable[Any], Any]]
+
+class Job:
+    """
+    Задача планировщика. Корутина выполняется в цикле событий, обычная
+    функция - в отдельном потоке, чтобы не задерживать обработку обновлений
+    """
+    def __init__(self, name: str, func: JobFunc, every: Optional[float] = None,
+                 cron: Optional[CronTrigger] = None, jitter: float = 0.0):
+        if (every is None) == (cron is None):
+            raise ValueError(f"Задача '{name}': нужно указать либо интервал, либо расписание cron")
+        if every is not None and every <= 0:
+            raise ValueError(f"Задача '{name}': интервал должен быть положительным")
+        self.name = name
+        self.func = func
+        self.every = every
+        self.cron = cron
+        self.jitter = jitter
+        self.stats = JobStats()
+        self.next_run_at: Optional[datetime] = None
+        self._running: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._running is not None and not self._running.done()
+
+    def _delay(self, scheduled: float) -> float:
+        """
+        Секунды до очередного запуска. scheduled - время предыдущего
+        запуска по расписанию (time.monotonic), для интервальных задач
+        отсчет идет от него, а не от фактического запуска
+        """
+        now = time.monotonic()
+        if self.every is not None:
+            delay = scheduled + self.every - now
+            if delay < 0:
+                # Отставание больше интервала: пропущенные запуски не наверстываются
+                delay %= self.every
+        else:
+            wall_now = datetime.now()
+            delay = (self.cron.next_after(wall_now) - wall_now).total_seconds()
+        self.next_run_at = datetime.now() + timedelta(seconds=delay)
+        return delay
+
+    async def _execute(self) -> None:
+        stats = self.stats
+        stats.last_started_at = datetime.now()
+        started = time.perf_counter()
+        try:
+            if inspect.iscoroutinefunction(self.func):
+                await self.func()
+            else:
+                await asyncio.to_thread(self.func)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stats.failures += 1
+            stats.last_error = repr(e)
+            logger.exception(f"Ошибка фоновой задачи '{self.name}'")
+        finally:
+            seconds = time.perf_counter() - started
+            stats.runs += 1
+            stats.total_seconds += seconds
+            stats.last_seconds = seconds
+            stats.max_seconds = max(stats.max_seconds, seconds)
+        logger.debug(f"Задача '{self.name}' выполнена за {seconds * 1000:.1f} мс")
+
+    def trigger(self) -> bool:
+        """
+        Запускает задачу, если предыдущий запуск закончился.
+        Возвращает False, если запуск пропущен
+        """
+        if self.running:
+            self.stats.skipped += 1
+            logger.warning(f"Задача '{self.name}' еще выполняется, очередной запуск пропущен")
+            return False
+        self._running = asyncio.create_task(self._execute(), name=f'job:{self.name}')
+        return True
+
+    async def _loop(self) -> None:
+        scheduled = time.monotonic()
+        while True:
+            delay = self._delay(scheduled)
+            scheduled = time.monotonic() + delay
+            await asyncio.sleep(delay + random.uniform(0, self.jitter))
+            self.trigger()
+
+    def __str__(self) -> str:
+        schedule = self.cron if self.cron is not None else f"каждые {self.every:g} с"
+        return f"{self.name} ({schedule})"
+
+class Scheduler:
+    """
+    Фоновые задачи бота. Задачи добавляются до или после start(),
+    stop() останавливает расписание и прерывает выполняющиеся запуски
+    """
+    def __init__(self, jitter: float = 0.0):
+        self.jitter = jitter
+        self.jobs: Dict[str, Job] = {}
+        self._loops: Dict[str, asyncio.Task] = {}
+        self._started = False
+
+    def add_job(self, name: str, func: JobFunc, every: Optional[float] = None,
+                cron: Optional[str] = None, jitter: Optional[float] = None) -> Job:
+        """
+        Добавляет задачу с интервалом every секунд или расписанием cron.
+        По умолчанию используется jitter планировщика
+        """
+        if name in self.jobs:
+            raise ValueError(f"Задача '{name}' уже добавлена")
+        job = Job(name, func, every, parse_cron(cron) if cron is not None else None,
+                  self.jitter if jitter is None else jitter)
+        self.jobs[name] = job
+        if self._started:
+            self._start_job(job)
+        return job
+
+    def _start_job(self, job: Job) -> None:
+        self._loops[job.name] = asyncio.create_task(job._loop(), name=f'schedule:{job.name}')
+        logger.info(f"Запланирована задача {job}")
+
+    def run_now(self, name: str) -> bool:
+        """
+        Внеплановый запуск задачи (с той же защитой от наложения)
+        """
+        return self.jobs[name].trigger()
+
+    def start(self) -> None:
+        """
+        Запускает расписание всех задач (нужен запущенный цикл событий)
+        """
+        if self._started:
+            return
+        self._started = True
+        for job in self.jobs.values():
+            self._start_job(job)
+
+    async def stop(self, timeout: float = 0.0) -> None:
+        """
+        Останавливает расписание, ждет завершения выполняющихся запусков
+        не дольше timeout секунд и отменяет оставшиеся
+        """
+        self._started = False
+        loops = list(self._loops.values())
+        self._loops.clear()
+        for task in loops:
+            task.cancel()
+
+        running = [job._running for job in self.jobs.values() if job.running]
+        if running and timeout > 0:
+            await asyncio.wait(running, timeout=timeout)
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*loops, *running, return_exceptions=True)
+        for job in self.jobs.values():
+            job._running = None
+            job.next_run_at = None
+            logger.info(f"Задача {job.name}: {job.stats}")
+
+scheduler = Scheduler()
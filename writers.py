@@ -0,0 +1,235 @@
+"""
+Фоновая пакетная запись в базу данных.
+
+Обработчики только складывают изменения в память, а фоновая задача
+записывает их пачками: по таймеру или при накоплении batch_size записей.
+"""
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from config import Settings
+from database import AuditEvent, insert_audit_events, set_audit_sink, upsert_users
+
+logger = logging.getLogger(__name__)
+
+class BatchWriter(ABC):
+    """
+    Базовый класс фоновой пакетной записи. Наследники хранят
+    накопленные изменения и реализуют _take_batch и _write
+    """
+    name = 'batch'
+
+    def __init__(self, flush_interval: float, batch_size: int):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.flushed_batches = 0
+        self.flushed_rows = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        # Создаются в цикле событий (start или первый flush), а не при импорте модуля
+        self._wakeup: Optional[asyncio.Event] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    @abstractmethod
+    def pending_count(self) -> int:
+        """
+        Число накопленных изменений
+        """
+
+    @abstractmethod
+    def _take_batch(self) -> list:
+        """
+        Забирает накопленные изменения, очищая буфер
+        """
+
+    @abstractmethod
+    def _write(self, batch: list) -> None:
+        """
+        Записывает пачку в базу (выполняется в отдельном потоке)
+        """
+
+    def _restore(self, batch: list) -> None:
+        """
+        Возвращает в буфер пачку, которую не удалось записать
+        """
+
+    def _close(self) -> None:
+        """
+        Освобождает ресурсы записи при остановке; вызывается, когда
+        ни одна пачка уже не пишется
+        """
+
+    def _notify(self) -> None:
+        """
+        Вызывается после добавления изменения: будит фоновую задачу,
+        если накопилась полная пачка
+        """
+        if self._wakeup is not None and self.pending_count() >= self.batch_size:
+            self._wakeup.set()
+
+    async def flush(self) -> int:
+        """
+        Записывает все накопленные изменения, возвращает число записей
+        """
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            batch = self._take_batch()
+            if not batch:
+                return 0
+            try:
+                await asyncio.to_thread(self._write, batch)
+            except Exception:
+                logger.exception(f"Ошибка записи пачки '{self.name}' ({len(batch)} записей)")
+                self._restore(batch)
+                return 0
+            self.flushed_batches += 1
+            self.flushed_rows += len(batch)
+            return len(batch)
+
+    async def _run(self) -> None:
+        # Задача не отменяется, а завершается по флагу: отмена не остановила бы
+        # поток записи, и его пачка писалась бы одновременно со следующей
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self) -> None:
+        if self._task is None:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name=f'writer:{self.name}')
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновую задачу, дождавшись начатой записи,
+        и записывает остаток буфера
+        """
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+            self._wakeup = None
+        await self.flush()
+        async with self._lock:
+            self._close()
+        # Следующий запуск может идти в другом цикле событий
+        self._lock = None
+
+class UserWriteBuffer(BatchWriter):
+    """
+    Отложенная регистрация пользователей и обновление их профилей.
+    Кэш недавно виденных пользователей позволяет не писать в базу,
+    если имя и username не изменились
+    """
+    name = 'users'
+
+    def __init__(self, flush_interval: float = 2.0, batch_size: int = 100, cache_size: int = 10000):
+        super().__init__(flush_interval, batch_size)
+        self.cache_size = cache_size
+        self.skipped = 0
+        self._known: 'OrderedDict[int, Tuple[Optional[str], str]]' = OrderedDict()
+        self._pending: Dict[int, Tuple[Optional[str], str]] = {}
+
+    def register(self, user_id: int, username: Optional[str], full_name: str) -> None:
+        """
+        Запоминает профиль пользователя для записи в базу
+        """
+        profile = (username, full_name)
+        if self._known.get(user_id) == profile:
+            self._known.move_to_end(user_id)
+            self.skipped += 1
+            return
+
+        self._known[user_id] = profile
+        self._known.move_to_end(user_id)
+        if len(self._known) > self.cache_size:
+            self._known.popitem(last=False)
+
+        self._pending[user_id] = profile
+        self._notify()
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _take_batch(self) -> List[Tuple[int, Optional[str], str]]:
+        pending, self._pending = self._pending, {}
+        return [(user_id, username, full_name) for user_id, (username, full_name) in pending.items()]
+
+    def _write(self, batch: List[Tuple[int, Optional[str], str]]) -> None:
+        upsert_users(batch)
+        logger.info(f"Сохранены профили пользователей: {len(batch)}")
+
+    def _restore(self, batch: List[Tuple[int, Optional[str], str]]) -> None:
+        # Более свежие профили, пришедшие во время записи, не перезаписываются
+        for user_id, username, full_name in batch:
+            self._pending.setdefault(user_id, (username, full_name))
+
+class AuditLogWriter(BatchWriter):
+    """
+    Очередь событий журнала изменений. Обработчики не ждут записи
+    журнала: события добавляются в очередь после фиксации изменения
+    """
+    name = 'audit'
+
+    def __init__(self, flush_interval: float = 1.0, batch_size: int = 200):
+        super().__init__(flush_interval, batch_size)
+        self._pending: List[AuditEvent] = []
+
+    def record(self, events: List[AuditEvent]) -> None:
+        """
+        Добавляет события в очередь на запись
+        """
+        self._pending.extend(events)
+        self._notify()
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def _take_batch(self) -> List[AuditEvent]:
+        pending, self._pending = self._pending, []
+        return pending
+
+    def _write(self, batch: List[AuditEvent]) -> None:
+        insert_audit_events(batch)
+
+    def _restore(self, batch: List[AuditEvent]) -> None:
+        self._pending[:0] = batch
+
+user_writer = UserWriteBuffer()
+audit_writer = AuditLogWriter()
+
+def configure_writers(settings: Settings) -> None:
+    """
+    Применяет настройки пакетной записи
+    """
+    user_writer.flush_interval = settings.user_flush_interval
+    user_writer.batch_size = settings.user_flush_batch_size
+    user_writer.cache_size = settings.user_cache_size
+    audit_writer.flush_interval = settings.audit_flush_interval
+    audit_writer.batch_size = settings.audit_flush_batch_size
+
+def start_writers() -> None:
+    """
+    Запускает фоновые задачи записи (нужен запущенный цикл событий).
+    С этого момента события журнала изменений идут через очередь
+    """
+    user_writer.start()
+    audit_writer.start()
+    set_audit_sink(audit_writer.record)
+
+async def stop_writers() -> None:
+    """
+    Останавливает фоновые задачи и записывает все накопленные изменения
+    """
+    set_audit_sink(None)
+    await user_writer.stop()
+    await audit_writer.stop()